@@ -0,0 +1,165 @@
+import os
+import queue
+import shutil
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
+from urllib.parse import urlparse, unquote
+
+from bs4 import BeautifulSoup
+
+from fetch import Fetcher
+from instrument import Instrumentation
+from parser import Parser
+from writer import Writer
+from syntax import UrbanSyntax
+
+
+def convert_pdf(filepath, cache=None, layout_mode='boxes', report=False, budget=None):
+    # With report=True, per-stage timings and counts are written next to
+    # the PDF as <name>.report.json. budget is a budget.Budget for the
+    # Parser; conversions that had to degrade a page are not cached.
+    # Images go to images/<name>/ next to the markdown; that directory
+    # belongs to this document alone and is emptied first, so converting
+    # a changed PDF again leaves none of the old images behind.
+    syntax = UrbanSyntax()
+    title = filepath.replace('.pdf', '')  # Name of file
+
+    writer = Writer()
+    writer.set_syntax(syntax)
+    writer.set_mode('simple')
+    writer.set_title(title)
+    name = os.path.basename(title)
+    writer.set_image_dir(os.path.join(os.path.dirname(title), 'images', name))
+    shutil.rmtree(writer.get_image_dir(), ignore_errors=True)
+
+    instrumentation = None
+    if report:
+        instrumentation = Instrumentation(filepath)
+        writer.set_instrumentation(instrumentation)
+
+    if cache is not None:
+        if instrumentation is not None:
+            started = instrumentation.clock()
+        key = cache.make_key(filepath, syntax, 'simple', layout_mode=layout_mode,
+                             image_links='images/' + name)
+        if cache.restore(key, writer):
+            if instrumentation is not None:
+                instrumentation.record('conversion_cache', instrumentation.clock() - started)
+                instrumentation.write_report(filepath.replace('.pdf', '.report.json'))
+            return writer.get_location()
+
+    with Parser(filepath, layout_mode=layout_mode, instrumentation=instrumentation,
+                budget=budget) as parser:
+        writer.write_stream(parser.iter_piles())
+
+    if cache is not None and not parser.degraded:
+        cache.store(key, writer)
+    if instrumentation is not None:
+        instrumentation.write_report(filepath.replace('.pdf', '.report.json'))
+
+    return writer.get_location()
+
+
+class BatchConverter(object):
+    # Two-stage pipeline: a thread pool downloads links while a process pool
+    # converts the PDFs that are already on disk. At most two conversions
+    # per worker are in flight; until one finishes no more downloads are
+    # taken off the bounded queue between the stages, so downloads pause
+    # once conversion falls behind.
+    # Every link gets its own result dict; a failing link only records its
+    # error and never aborts the rest of the batch. Downloads go through a
+    # fetch.Fetcher whose metadata lives in the folder, so files that are
+    # still there from an earlier run are only fetched again if they
+    # changed on the server. budget (a budget.Budget) keeps one bad
+    # document from holding a conversion worker for long.
+    def __init__(self, folder, download_workers=4, convert_workers=None,
+                 queue_size=8, timeout=60, cache=None, layout_mode='boxes',
+                 report=False, fetcher=None, budget=None):
+        self._folder = folder
+        if fetcher is None:
+            fetcher = Fetcher(os.path.join(folder, 'fetch.json'),
+                              per_host=download_workers, timeout=timeout)
+        self._fetcher = fetcher
+        self._cache = cache
+        self._layout_mode = layout_mode
+        self._report = report
+        self._budget = budget
+        self._download_workers = download_workers
+        self._convert_workers = convert_workers
+        self._queue_size = queue_size
+
+    def run(self, links):
+        results = [{'url': link, 'path': None, 'location': None,
+                    'content': None, 'error': None} for link in links]
+        if not links:
+            return results
+
+        convert_workers = self._convert_workers or os.cpu_count() or 1
+        downloaded = queue.Queue(maxsize=self._queue_size)
+        conversions = {}
+        with ThreadPoolExecutor(max_workers=self._download_workers) as downloader, \
+                ProcessPoolExecutor(max_workers=convert_workers) as converter:
+            for idx, link in enumerate(links):
+                downloader.submit(self._download, idx, link, downloaded)
+
+            # Every download puts exactly one item, successful or not.
+            for _ in range(len(links)):
+                # submit() never blocks, so wait here instead
+                while len(conversions) >= convert_workers * 2:
+                    self._collect(conversions, results)
+                idx, path, content, error = downloaded.get()
+                result = results[idx]
+                result['path'] = path
+                if error is not None:
+                    result['error'] = error
+                elif content is not None:
+                    result['content'] = content
+                else:
+                    conversions[converter.submit(
+                        convert_pdf, path, self._cache, self._layout_mode,
+                        self._report, self._budget)] = idx
+
+            while conversions:
+                self._collect(conversions, results)
+
+        return results
+
+    def _collect(self, conversions, results):
+        done, _ = wait(conversions, return_when=FIRST_COMPLETED)
+        for future in done:
+            idx = conversions.pop(future)
+            try:
+                results[idx]['location'] = future.result()
+            except Exception as e:
+                results[idx]['error'] = e
+
+    def _download(self, idx, link, downloaded):
+        try:
+            if link.lower().endswith('.pdf'):
+                item = (idx, self._download_pdf(link), None, None)
+            else:
+                item = (idx,) + self._download_page(link) + (None,)
+        except Exception as e:
+            item = (idx, None, None, e)
+        downloaded.put(item)
+
+    def _download_pdf(self, url):
+        filename = "PDF_" + os.path.basename(unquote(urlparse(url).path))
+        filepath = os.path.join(self._folder, filename)
+        self._fetcher.fetch(url, filepath)
+        return filepath
+
+    def _download_page(self, url):
+        html_path = os.path.join(self._folder, "LINK_" + url.split('/')[-1] + ".html")
+        self._fetcher.fetch(url, html_path)
+        with open(html_path, 'rb') as fread:
+            soup = BeautifulSoup(fread, 'html.parser')
+        text = soup.get_text()
+
+        filename = "LINK_" + url.split('/')[-1] + ".txt"
+        filepath = os.path.join(self._folder, filename)
+        with open(filepath, "w", encoding="utf-8") as f:
+            f.write(text)
+        return filepath, text
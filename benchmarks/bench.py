@@ -0,0 +1,226 @@
+import argparse
+import gc
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pdfminer.converter import PDFPageAggregator
+from pdfminer.layout import LAParams
+from pdfminer.pdfdocument import PDFDocument
+from pdfminer.pdfinterp import PDFPageInterpreter
+from pdfminer.pdfinterp import PDFResourceManager
+from pdfminer.pdfpage import PDFPage
+from pdfminer.pdfparser import PDFParser
+
+import corpus
+from parser import LineAggregator
+from pile import Pile
+from syntax import UrbanSyntax
+from writer import Writer
+
+
+STAGES = ('interpret', 'parse_layout', 'split_piles', 'gen_markdown', 'write')
+
+
+def run_document(filename, layout_mode='boxes'):
+    # One conversion of filename with every stage timed on its own. The
+    # stages mirror Parser + Writer: 'interpret' is pdfminer interpreting
+    # the page and analysing its layout, 'write' is Writer.write (which
+    # generates the markdown again and exports images).
+    timings = dict.fromkeys(STAGES, 0.0)
+    clock = time.perf_counter
+
+    rsrcmgr = PDFResourceManager()
+    aggregator = LineAggregator if layout_mode == 'lines' else PDFPageAggregator
+    device = aggregator(rsrcmgr, laparams=LAParams())
+    interpreter = PDFPageInterpreter(rsrcmgr, device)
+    syntax = UrbanSyntax()
+
+    piles = []
+    pages = 0
+    with open(filename, 'rb') as fread:
+        document = PDFDocument(PDFParser(fread))
+        for page in PDFPage.create_pages(document):
+            pages += 1
+            start = clock()
+            interpreter.process_page(page)
+            layout = device.get_result()
+            timings['interpret'] += clock() - start
+
+            start = clock()
+            pile = Pile()
+            pile.parse_layout(layout)
+            del layout
+            timings['parse_layout'] += clock() - start
+
+            start = clock()
+            piles += pile.split_piles()
+            timings['split_piles'] += clock() - start
+
+        start = clock()
+        for pile in piles:
+            if pile.get_type() != 'image':
+                pile.gen_markdown(syntax)
+        timings['gen_markdown'] += clock() - start
+
+        workdir = tempfile.mkdtemp(prefix='pdf2md-bench-')
+        cwd = os.getcwd()
+        try:
+            os.chdir(workdir)
+            writer = Writer()
+            writer.set_syntax(syntax)
+            writer.set_mode('simple')
+            writer.set_title('bench')
+            start = clock()
+            writer.write(piles)
+            timings['write'] += clock() - start
+        finally:
+            os.chdir(cwd)
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    return pages, timings
+
+
+def measure(filename, repeat, layout_mode):
+    # Best of repeat runs per stage, then one run under tracemalloc for the
+    # peak (tracing slows everything down, so it is never timed).
+    best = None
+    for idx in range(repeat):
+        gc.collect()
+        pages, timings = run_document(filename, layout_mode)
+        if best is None:
+            best = timings
+        else:
+            best = {stage: min(best[stage], timings[stage]) for stage in STAGES}
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        run_document(filename, layout_mode)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    total = sum(best.values())
+    return {
+        'pages': pages,
+        'stages': best,
+        'total': total,
+        'pages_per_sec': pages / total if total else 0.0,
+        'peak_bytes': peak,
+    }
+
+
+def compare(results, baseline, tolerance, min_delta):
+    # Returns a list of human readable regressions (empty when none)
+    regressions = []
+    for name, result in results['documents'].items():
+        base = baseline.get('documents', {}).get(name)
+        if base is None:
+            continue
+        checks = [(stage, result['stages'][stage], base['stages'].get(stage)) for stage in STAGES]
+        checks.append(('total', result['total'], base.get('total')))
+        for label, new, old in checks:
+            if old is not None and new > old * (1 + tolerance) and new - old > min_delta:
+                regressions.append('{}: {} took {:.3f}s, baseline {:.3f}s (+{:.0%})'.format(
+                    name, label, new, old, new / old - 1 if old else float('inf')))
+        old_peak = base.get('peak_bytes')
+        if old_peak and result['peak_bytes'] > old_peak * (1 + tolerance):
+            regressions.append('{}: peak memory {:.1f} MiB, baseline {:.1f} MiB'.format(
+                name, result['peak_bytes'] / 2 ** 20, old_peak / 2 ** 20))
+    return regressions
+
+
+def report(results, baseline):
+    header = '{:<14} {:>5} ' + ' '.join('{:>12}' for stage in STAGES) + ' {:>9} {:>9}'
+    print(header.format('document', 'pages', *STAGES, 'pages/s', 'peak MiB'))
+    for name, result in results['documents'].items():
+        row = '{:<14} {:>5} ' + ' '.join('{:>12.4f}' for stage in STAGES) + ' {:>9.1f} {:>9.1f}'
+        print(row.format(name, result['pages'], *(result['stages'][stage] for stage in STAGES),
+                         result['pages_per_sec'], result['peak_bytes'] / 2 ** 20))
+        base = baseline.get('documents', {}).get(name) if baseline else None
+        if base:
+            print('{:<14} {:>5} {:>+12.1%} (total vs baseline)'.format(
+                '', '', result['total'] / base['total'] - 1 if base['total'] else 0.0))
+
+
+def main():
+    here = os.path.dirname(os.path.abspath(__file__))
+    argparser = argparse.ArgumentParser(description='Benchmark pdf2md on a generated corpus.')
+    argparser.add_argument('--corpus', default=os.path.join(here, 'corpus'),
+                           help='where the generated PDFs are written')
+    argparser.add_argument('--only', action='append', choices=sorted(corpus.DOCUMENTS),
+                           help='benchmark only this document (repeatable)')
+    argparser.add_argument('--repeat', type=int, default=3, help='timed runs per document')
+    argparser.add_argument('--layout-mode', default='boxes', choices=('boxes', 'lines'))
+    argparser.add_argument('--baseline', default=os.path.join(here, 'baseline.json'),
+                           help='results to compare against')
+    argparser.add_argument('--save-baseline', action='store_true',
+                           help='store these results as the new baseline')
+    argparser.add_argument('--output', help='also write the results as JSON to this file')
+    argparser.add_argument('--tolerance', type=float, default=0.25,
+                           help='allowed slowdown / memory growth as a fraction')
+    argparser.add_argument('--min-delta', type=float, default=0.005,
+                           help='ignore slowdowns shorter than this many seconds')
+    argparser.add_argument('--require-baseline', action='store_true',
+                           help='fail (exit code 2) when there is no baseline to compare against')
+    args = argparser.parse_args()
+
+    has_baseline = os.path.exists(args.baseline)
+    if args.require_baseline and not has_baseline and not args.save_baseline:
+        print('ERROR: no baseline at', args.baseline, file=sys.stderr)
+        return 2
+
+    paths = corpus.generate(args.corpus)
+    names = args.only or list(corpus.DOCUMENTS)
+
+    results = {
+        'python': platform.python_version(),
+        'layout_mode': args.layout_mode,
+        'documents': {},
+    }
+    for name in names:
+        results['documents'][name] = measure(paths[name], args.repeat, args.layout_mode)
+
+    baseline = None
+    if has_baseline and not args.save_baseline:
+        with open(args.baseline, encoding='utf-8') as fread:
+            baseline = json.load(fread)
+    report(results, baseline)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as fwrite:
+            json.dump(results, fwrite, indent=2, sort_keys=True)
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as fwrite:
+            json.dump(results, fwrite, indent=2, sort_keys=True)
+        print('Baseline saved to', args.baseline)
+        return 0
+
+    if baseline is not None:
+        if baseline.get('layout_mode', 'boxes') != args.layout_mode:
+            print('Baseline was recorded with layout mode', baseline.get('layout_mode'))
+        regressions = compare(results, baseline, args.tolerance, args.min_delta)
+        if regressions:
+            print()
+            print('PERFORMANCE REGRESSION')
+            for line in regressions:
+                print('  ' + line)
+            return 1
+        print('No regressions against', args.baseline)
+    else:
+        print()
+        print('WARNING: no baseline at {}, nothing was compared; record one with '
+              '--save-baseline'.format(args.baseline), file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
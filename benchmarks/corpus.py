@@ -0,0 +1,267 @@
+import os
+import random
+import zlib
+
+
+WORDS = ('fund assets shares units value period report trust manager '
+         'investment account income rules holder market price order '
+         'register payment term notice capital return annual section '
+         'statement company agreement transfer balance interest').split()
+
+PAGE_WIDTH = 595
+PAGE_HEIGHT = 842
+
+
+class PdfDocument(object):
+    # Minimal PDF writer: standard Type1 fonts, filled rectangles and RGB
+    # images, nothing else. Output depends only on what is drawn, so the
+    # same calls always give the same bytes.
+    _FONTS = {'F1': 'Helvetica', 'F2': 'Helvetica-Bold'}
+
+    def __init__(self):
+        self._objects = [None, None]  # catalog and page tree come first
+        self._fonts = {}
+        for name, base in self._FONTS.items():
+            self._fonts[name] = self._add(
+                '<< /Type /Font /Subtype /Type1 /BaseFont /{} '
+                '/Encoding /WinAnsiEncoding >>'.format(base).encode('latin-1'))
+        self._pages = []
+
+    def new_page(self):
+        page = PdfPage(self)
+        self._pages.append(page)
+        return page
+
+    def add_image(self, width, height, pixels):
+        data = zlib.compress(pixels, 6)
+        header = ('<< /Type /XObject /Subtype /Image /Width {} /Height {} '
+                  '/ColorSpace /DeviceRGB /BitsPerComponent 8 '
+                  '/Filter /FlateDecode /Length {} >>').format(width, height, len(data))
+        return self._add(_stream(header, data))
+
+    def save(self, filename):
+        kids = []
+        for page in self._pages:
+            content = page.get_content()
+            contents = self._add(_stream('<< /Length {} >>'.format(len(content)), content))
+            fonts = ' '.join('/{} {} 0 R'.format(name, objid)
+                             for name, objid in sorted(self._fonts.items()))
+            images = ' '.join('/Im{} {} 0 R'.format(objid, objid) for objid in page.images)
+            kids.append(self._add(
+                ('<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {} {}] '
+                 '/Resources << /Font << {} >> /XObject << {} >> >> '
+                 '/Contents {} 0 R >>').format(
+                     PAGE_WIDTH, PAGE_HEIGHT, fonts, images, contents).encode('latin-1')))
+
+        self._objects[0] = b'<< /Type /Catalog /Pages 2 0 R >>'
+        self._objects[1] = '<< /Type /Pages /Kids [{}] /Count {} >>'.format(
+            ' '.join('{} 0 R'.format(kid) for kid in kids), len(kids)).encode('latin-1')
+
+        out = bytearray(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+        offsets = []
+        for objid, body in enumerate(self._objects, 1):
+            offsets.append(len(out))
+            out += b'%d 0 obj\n' % objid + body + b'\nendobj\n'
+        xref = len(out)
+        out += b'xref\n0 %d\n0000000000 65535 f \n' % (len(self._objects) + 1)
+        for offset in offsets:
+            out += b'%010d 00000 n \n' % offset
+        out += b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (
+            len(self._objects) + 1, xref)
+
+        with open(filename, 'wb') as fwrite:
+            fwrite.write(bytes(out))
+
+    def _add(self, body):
+        self._objects.append(body)
+        return len(self._objects)
+
+
+class PdfPage(object):
+    def __init__(self, document):
+        self._document = document
+        self._ops = []
+        self.images = []
+
+    def text(self, x, y, string, size=10, bold=False):
+        font = 'F2' if bold else 'F1'
+        self._ops.append('BT /{} {} Tf {:.2f} {:.2f} Td ({}) Tj ET'.format(
+            font, size, x, y, _escape(string)))
+
+    def rect(self, x, y, width, height):
+        self._ops.append('{:.2f} {:.2f} {:.2f} {:.2f} re f'.format(x, y, width, height))
+
+    def image(self, objid, x, y, width, height):
+        if objid not in self.images:
+            self.images.append(objid)
+        self._ops.append('q {:.2f} 0 0 {:.2f} {:.2f} {:.2f} cm /Im{} Do Q'.format(
+            width, height, x, y, objid))
+
+    def get_content(self):
+        return '\n'.join(self._ops).encode('latin-1')
+
+
+def _stream(header, data):
+    return header.encode('latin-1') + b'\nstream\n' + data + b'\nendstream'
+
+
+def _escape(string):
+    return string.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+
+def _sentence(rnd, low=4, high=12):
+    return ' '.join(rnd.choice(WORDS) for idx in range(rnd.randint(low, high)))
+
+
+def _prose(page, rnd, y, lines, size=10):
+    # Returns the y of the next free line, or None when the page is full
+    for idx in range(lines):
+        if y < 60:
+            return None
+        text = _sentence(rnd)
+        if idx % 6 == 5:
+            text += '.'
+        page.text(72, y, text, size)
+        y -= size + 4
+    return y
+
+
+def _table(page, rnd, x, y, rows, cols, col_width=60, row_height=16, merged=False):
+    # Ruled table with one label per cell; merged tables leave out some
+    # inner rules, so cells span several columns or rows.
+    width = cols * col_width
+    height = rows * row_height
+    skip_vertical = set()
+    skip_horizontal = set()
+    if merged:
+        for row in range(rows):
+            if rnd.random() < 0.3:
+                skip_vertical.add((rnd.randint(1, cols - 1), row))
+        for col in range(cols):
+            if rnd.random() < 0.3:
+                skip_horizontal.add((rnd.randint(1, rows - 1), col))
+
+    for row in range(rows + 1):
+        for col in range(cols):
+            if (row, col) not in skip_horizontal:
+                page.rect(x + col * col_width, y - row * row_height, col_width, 0.5)
+    for col in range(cols + 1):
+        for row in range(rows):
+            if (col, row) not in skip_vertical:
+                page.rect(x + col * col_width, y - (row + 1) * row_height, 0.5, row_height)
+
+    for row in range(rows):
+        for col in range(cols):
+            page.text(x + col * col_width + 3, y - (row + 1) * row_height + 5,
+                      '{}.{} {}'.format(row, col, rnd.choice(WORDS)), 7)
+    return y - height - 24
+
+
+def _gradient(width, height, seed):
+    pixels = bytearray()
+    for row in range(height):
+        for col in range(width):
+            pixels += bytes(((col * 7 + seed) % 256, (row * 5) % 256, (seed * 31) % 256))
+    return bytes(pixels)
+
+
+def build_prose(filename, pages=20):
+    rnd = random.Random(1)
+    doc = PdfDocument()
+    for num in range(pages):
+        page = doc.new_page()
+        _prose(page, rnd, 780, 50)
+        page.text(300, 30, str(num + 1), 9)
+    doc.save(filename)
+
+
+def build_headings(filename, pages=20):
+    rnd = random.Random(2)
+    doc = PdfDocument()
+    chapter = 0
+    for num in range(pages):
+        page = doc.new_page()
+        y = 790
+        while y is not None and y > 120:
+            chapter += 1
+            page.text(150, y, '{}. {}'.format(chapter, _sentence(rnd, 2, 4).upper()), 16, bold=True)
+            y -= 28
+            for section in range(1, rnd.randint(2, 4)):
+                page.text(72, y, '{}.{}. {}'.format(chapter, section, _sentence(rnd, 2, 5)), 12, bold=True)
+                y = _prose(page, rnd, y - 18, rnd.randint(2, 5))
+                if y is None or y < 120:
+                    break
+        page.text(300, 30, str(num + 1), 9)
+    doc.save(filename)
+
+
+def build_ruled_tables(filename, pages=4):
+    rnd = random.Random(3)
+    doc = PdfDocument()
+    for num in range(pages):
+        page = doc.new_page()
+        page.text(72, 805, 'RULED TABLE {}'.format(num + 1), 14, bold=True)
+        _table(page, rnd, 40, 785, 45, 8)
+    doc.save(filename)
+
+
+def build_merged_tables(filename, pages=4):
+    rnd = random.Random(4)
+    doc = PdfDocument()
+    for num in range(pages):
+        page = doc.new_page()
+        page.text(72, 805, 'MERGED TABLE {}'.format(num + 1), 14, bold=True)
+        y = _table(page, rnd, 40, 785, 20, 6, merged=True)
+        y = _prose(page, rnd, y, 4)
+        _table(page, rnd, 40, y, 15, 7, merged=True)
+    doc.save(filename)
+
+
+def build_images(filename, pages=10):
+    rnd = random.Random(5)
+    doc = PdfDocument()
+    images = [doc.add_image(64, 48, _gradient(64, 48, seed)) for seed in range(4)]
+    for num in range(pages):
+        page = doc.new_page()
+        y = 780
+        for idx in range(3):
+            page.image(images[(num + idx) % len(images)], 72, y - 150, 200, 150)
+            y = _prose(page, rnd, y - 168, 4)
+    doc.save(filename)
+
+
+def build_many_pages(filename, pages=200):
+    rnd = random.Random(6)
+    doc = PdfDocument()
+    for num in range(pages):
+        page = doc.new_page()
+        page.text(72, 790, '{}. {}'.format(num + 1, _sentence(rnd, 2, 4).upper()), 12, bold=True)
+        _prose(page, rnd, 770, 12)
+        page.text(300, 30, str(num + 1), 9)
+    doc.save(filename)
+
+
+DOCUMENTS = {
+    'prose': build_prose,
+    'headings': build_headings,
+    'ruled_tables': build_ruled_tables,
+    'merged_tables': build_merged_tables,
+    'images': build_images,
+    'many_pages': build_many_pages,
+}
+
+
+def generate(directory):
+    # Writes every corpus document into directory; returns name -> path
+    os.makedirs(directory, exist_ok=True)
+    paths = {}
+    for name, build in DOCUMENTS.items():
+        paths[name] = os.path.join(directory, name + '.pdf')
+        build(paths[name])
+    return paths
+
+
+if __name__ == '__main__':
+    import sys
+    for name, path in generate(sys.argv[1] if len(sys.argv) > 1 else 'corpus').items():
+        print(name, path)
@@ -0,0 +1,42 @@
+from pile import Pile
+
+
+class Budget(object):
+    # Limits that keep one pathological page from stalling a conversion.
+    # None leaves a limit off.
+    #   page_seconds      interpretation time of one page
+    #   page_objects      chars, paths and images one page may draw (the
+    #                     layout objects are what pages spend memory on)
+    #   document_seconds  time for the whole document, from opening it
+    #   table_rules       rules one page may have before its tables are
+    #                     not reconstructed
+    # A page over page_seconds or page_objects is interpreted again as
+    # text only (no paths, line grouping only); if that is over budget
+    # too, or the document is out of time, the page is skipped and a
+    # SkippedPage marker takes its place.
+    def __init__(self, page_seconds=None, page_objects=None,
+                 document_seconds=None, table_rules=None):
+        self.page_seconds = page_seconds
+        self.page_objects = page_objects
+        self.document_seconds = document_seconds
+        self.table_rules = table_rules
+
+
+class BudgetExceeded(Exception):
+    def __init__(self, limit):
+        Exception.__init__(self, limit)
+        self.limit = limit
+
+
+class SkippedPage(Pile):
+    # Stands in for a page that was not converted
+    def __init__(self, page_num, limit):
+        Pile.__init__(self)
+        self.page_num = page_num
+        self.limit = limit
+
+    def split_piles(self):
+        return [self]
+
+    def gen_markdown(self, syntax):
+        return '<!-- page {} skipped: {} exceeded -->\n\n'.format(self.page_num, self.limit)
@@ -0,0 +1,332 @@
+import hashlib
+import json
+import os
+import pickle
+import shutil
+import sys
+import threading
+import uuid
+from collections import OrderedDict
+from pdfminer.layout import LAParams
+from pdfminer.pdftypes import PDFObjRef
+from pdfminer.pdftypes import PDFStream
+from pdfminer.psparser import PSLiteral
+
+
+_FORMAT_VERSION = 3
+
+
+class ConversionCache(object):
+    # Finished conversions (markdown plus exported images) stored under a
+    # key made of the PDF's SHA-256 and the converter configuration.
+    #
+    # Entries are assembled in a private temporary directory and renamed
+    # into place, so several processes can share one cache: a reader sees
+    # either a complete entry or none. When the total size goes over
+    # max_bytes the least recently used entries are dropped.
+    def __init__(self, directory, max_bytes=1024 ** 3):
+        self._directory = directory
+        self._max_bytes = max_bytes
+
+    def make_key(self, filepath, syntax, mode, laparams=None, layout_mode='boxes',
+                 image_links='images'):
+        # image_links is the path the markdown links images by
+        digest = hashlib.sha256()
+        with open(filepath, 'rb') as fread:
+            for chunk in iter(lambda: fread.read(1 << 20), b''):
+                digest.update(chunk)
+
+        if laparams is None:
+            laparams = LAParams()
+        config = {
+            'version': _FORMAT_VERSION,
+            'syntax': type(syntax).__module__ + '.' + type(syntax).__qualname__,
+            'mode': mode,
+            'laparams': vars(laparams),
+            'layout_mode': layout_mode,
+            'image_links': image_links,
+        }
+        digest.update(json.dumps(config, sort_keys=True, default=repr).encode('utf-8'))
+        return digest.hexdigest()
+
+    def restore(self, key, writer):
+        # Puts a cached conversion where writer would have written it.
+        # Returns False on a miss, in which case nothing is written.
+        entry = self._entry_dir(key)
+        meta_path = os.path.join(entry, 'meta.json')
+        try:
+            with open(meta_path, encoding='utf-8') as fread:
+                meta = json.load(fread)
+
+            image_dir = writer.get_image_dir()
+            for name in meta['images']:
+                target = os.path.join(image_dir, name)
+                # Never overwrite another document's image of the same name
+                if os.path.exists(target) and \
+                        not _same_content(os.path.join(entry, 'images', name), target):
+                    return False
+
+            if meta['images']:
+                os.makedirs(image_dir, exist_ok=True)
+            for name in meta['images']:
+                shutil.copyfile(os.path.join(entry, 'images', name),
+                                os.path.join(image_dir, name))
+            _copy(os.path.join(entry, 'output'), writer.get_location())
+
+            os.utime(meta_path)  # mark as recently used
+        except (OSError, ValueError, KeyError):
+            return False
+        return True
+
+    def store(self, key, writer):
+        entry = self._entry_dir(key)
+        if os.path.exists(entry):
+            return
+
+        tmp = os.path.join(self._directory, 'tmp', uuid.uuid4().hex)
+        try:
+            os.makedirs(os.path.join(tmp, 'images'))
+            images = writer.get_images()
+            for name in images:
+                shutil.copyfile(os.path.join(writer.get_image_dir(), name),
+                                os.path.join(tmp, 'images', name))
+            _copy(writer.get_location(), os.path.join(tmp, 'output'))
+
+            meta = {'images': images, 'size': _disk_usage(tmp)}
+            with open(os.path.join(tmp, 'meta.json'), 'w', encoding='utf-8') as fwrite:
+                json.dump(meta, fwrite)
+
+            os.makedirs(os.path.dirname(entry), exist_ok=True)
+            os.rename(tmp, entry)
+        except OSError:
+            # Most likely another worker stored the same entry first
+            shutil.rmtree(tmp, ignore_errors=True)
+            return
+
+        self._evict()
+
+    def _entry_dir(self, key):
+        return os.path.join(self._directory, 'entries', key)
+
+    def _evict(self):
+        entries_dir = os.path.join(self._directory, 'entries')
+        entries = []
+        total = 0
+        for key in os.listdir(entries_dir):
+            meta_path = os.path.join(entries_dir, key, 'meta.json')
+            try:
+                used = os.path.getmtime(meta_path)
+                with open(meta_path, encoding='utf-8') as fread:
+                    size = json.load(fread)['size']
+            except (OSError, ValueError, KeyError):
+                continue
+            entries.append((used, key, size))
+            total += size
+
+        entries.sort()
+        for used, key, size in entries:
+            if total <= self._max_bytes:
+                break
+            # Rename first so readers never see a half-deleted entry
+            trash = os.path.join(self._directory, 'tmp', uuid.uuid4().hex)
+            try:
+                os.rename(os.path.join(entries_dir, key), trash)
+            except OSError:
+                continue
+            shutil.rmtree(trash, ignore_errors=True)
+            total -= size
+
+
+class LayoutCache(object):
+    # Per-page primitives collected by Pile.parse_layout (text lines with
+    # geometry and fonts, rules, images), pickled to disk under a digest of
+    # the page content. A warm rerun skips pdfminer interpretation and
+    # layout analysis and goes straight to split_piles/gen_markdown, which
+    # makes iterating on syntax or post-processing rules cheap.
+    def __init__(self, directory):
+        self._directory = directory
+
+    def page_key(self, page, laparams, memo, layout_mode='boxes'):
+        # memo maps object ids to digests, so resources shared between the
+        # pages of one document (fonts, mostly) are only hashed once.
+        digest = hashlib.sha256()
+        config = {'version': _FORMAT_VERSION, 'laparams': vars(laparams),
+                  'layout_mode': layout_mode}
+        digest.update(json.dumps(config, sort_keys=True, default=repr).encode('utf-8'))
+        digest.update(repr((page.mediabox, page.cropbox, page.rotate)).encode('utf-8'))
+        digest.update(_object_digest(page.contents, memo))
+        digest.update(_object_digest(page.resources, memo))
+        return digest.hexdigest()
+
+    def load(self, key):
+        try:
+            with open(self._path(key), 'rb') as fread:
+                return pickle.load(fread)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+
+    def save(self, key, pile):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = '{}.{}.tmp'.format(path, uuid.uuid4().hex)
+        try:
+            with open(tmp, 'wb') as fwrite:
+                pickle.dump(pile, fwrite, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, path)
+        except OSError:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    def _path(self, key):
+        return os.path.join(self._directory, key[:2], key + '.pickle')
+
+
+class LayoutLRU(object):
+    # Laid-out pages (Pile.parse_layout results) kept in memory for random
+    # access. Once their estimated size goes over max_bytes the least
+    # recently used pages are dropped; the newest one always stays.
+    def __init__(self, max_bytes=64 * 1024 ** 2):
+        self._max_bytes = max_bytes
+        self._piles = OrderedDict()  # key -> (pile, estimated size)
+        self._bytes = 0
+
+    def __contains__(self, key):
+        return key in self._piles
+
+    def get(self, key):
+        entry = self._piles.get(key)
+        if entry is None:
+            return None
+        self._piles.move_to_end(key)
+        return entry[0]
+
+    def put(self, key, pile):
+        if key in self._piles:
+            self._bytes -= self._piles.pop(key)[1]
+        size = _pile_size(pile)
+        self._piles[key] = (pile, size)
+        self._bytes += size
+
+        while self._bytes > self._max_bytes and len(self._piles) > 1:
+            old_key, (old_pile, old_size) = self._piles.popitem(last=False)
+            self._bytes -= old_size
+
+
+class FontCache(object):
+    # pdfminer fonts (widths, encodings, embedded CMaps and font programs
+    # already parsed) shared between documents, keyed by a digest of the
+    # font dictionary with everything it references. Batches of PDFs from
+    # one source embed the same fonts over and over; a hit skips building
+    # the font again. At most max_fonts are kept, least recently used go
+    # first; max_fonts=0 disables sharing.
+    def __init__(self, max_fonts=256):
+        self.max_fonts = max_fonts
+        self.hits = 0
+        self.misses = 0
+        self._fonts = OrderedDict()
+        self._lock = threading.Lock()
+
+    def font_key(self, spec, memo):
+        return _object_digest(spec, memo)
+
+    def get(self, key):
+        with self._lock:
+            font = self._fonts.get(key)
+            if font is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._fonts.move_to_end(key)
+            return font
+
+    def put(self, key, font):
+        if not self.max_fonts:
+            return
+        _unbind_font(font)
+        with self._lock:
+            self._fonts[key] = font
+            self._fonts.move_to_end(key)
+            while len(self._fonts) > self.max_fonts:
+                self._fonts.popitem(last=False)
+
+    def __len__(self):
+        return len(self._fonts)
+
+
+def _unbind_font(font):
+    # The descriptor, font file and CID system info are only read while the
+    # font is built; dropping them keeps a cached font from holding on to
+    # the whole document it came from.
+    font.descriptor = {}
+    if hasattr(font, 'fontfile'):
+        font.fontfile = None
+    if hasattr(font, 'cidsysteminfo'):
+        font.cidsysteminfo = {}
+
+
+def _pile_size(pile):
+    # Records, their coordinates and strings, and any image data they hold
+    size = sys.getsizeof(pile)
+    box = 4 * sys.getsizeof(0.0)
+    for text in pile.texts:
+        size += sys.getsizeof(text) + box + sys.getsizeof(text.text)
+        fonts = getattr(text, 'fonts', None)
+        if fonts is not None:
+            size += sys.getsizeof(fonts) + sys.getsizeof(fonts.names) + sys.getsizeof(fonts.sizes)
+    for rule in pile.verticals + pile.horizontals:
+        size += sys.getsizeof(rule) + box
+    for image in pile.images:
+        size += sys.getsizeof(image) + box
+        for attr in ('rawdata', 'data'):
+            size += len(getattr(image.stream, attr, None) or b'')
+    return size
+
+
+def _object_digest(obj, memo):
+    if isinstance(obj, PDFObjRef):
+        if obj.objid in memo:
+            return memo[obj.objid]
+        memo[obj.objid] = b'ref:%d' % obj.objid  # breaks reference cycles
+        value = _object_digest(obj.resolve(), memo)
+        memo[obj.objid] = value
+        return value
+
+    digest = hashlib.sha256()
+    if isinstance(obj, PDFStream):
+        digest.update(b'stream')
+        digest.update(_object_digest(obj.attrs, memo))
+        digest.update(obj.get_data() or b'')
+    elif isinstance(obj, dict):
+        digest.update(b'dict')
+        for key in sorted(obj, key=repr):
+            digest.update(repr(key).encode('utf-8'))
+            digest.update(_object_digest(obj[key], memo))
+    elif isinstance(obj, list):
+        digest.update(b'list')
+        for value in obj:
+            digest.update(_object_digest(value, memo))
+    elif isinstance(obj, PSLiteral):
+        digest.update(b'literal' + repr(obj.name).encode('utf-8'))
+    else:
+        digest.update(repr(obj).encode('utf-8'))
+    return digest.digest()
+
+
+def _copy(source, target):
+    if os.path.isdir(source):
+        shutil.copytree(source, target, dirs_exist_ok=True)
+    else:
+        shutil.copyfile(source, target)
+
+
+def _same_content(first, second):
+    with open(first, 'rb') as ffirst, open(second, 'rb') as fsecond:
+        return ffirst.read() == fsecond.read()
+
+
+def _disk_usage(path):
+    size = 0
+    for dirpath, dirnames, filenames in os.walk(path):
+        for filename in filenames:
+            size += os.path.getsize(os.path.join(dirpath, filename))
+    return size
@@ -0,0 +1,144 @@
+import json
+import os
+import threading
+import time
+import uuid
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+_RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class Fetcher(object):
+    # Downloads through one pooled requests.Session (connections are kept
+    # alive and reused per host), streaming the body to disk in chunks.
+    # The ETag / Last-Modified of every download is kept in a JSON file;
+    # fetching the same URL to the same path again sends a conditional
+    # request and leaves the file alone on 304. Connection errors,
+    # timeouts, 429 and 5xx are retried with exponential backoff (or the
+    # server's Retry-After), including errors while the body is streamed:
+    # a retry requests the whole file again. At most per_host requests
+    # run against one host at a time, however many threads share it.
+    def __init__(self, store_path, per_host=4, retries=3, backoff=0.5,
+                 timeout=60, chunk_size=1 << 16):
+        self._store = _MetadataStore(store_path)
+        self._per_host = per_host
+        self._retries = retries
+        self._backoff = backoff
+        self._timeout = timeout
+        self._chunk_size = chunk_size
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=16, pool_maxsize=per_host)
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
+
+    def fetch(self, url, filepath):
+        # Returns True when filepath was (re)written, False when the server
+        # said the copy already there is current.
+        headers = {}
+        meta = self._store.get(url)
+        if meta is not None and meta['path'] == filepath and os.path.exists(filepath):
+            if meta.get('etag'):
+                headers['If-None-Match'] = meta['etag']
+            if meta.get('last_modified'):
+                headers['If-Modified-Since'] = meta['last_modified']
+
+        with self._host_slot(url):
+            response = self._download(url, filepath, headers)
+        if response is None:
+            return False
+
+        self._store.put(url, {
+            'path': filepath,
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+        })
+        return True
+
+    def close(self):
+        self._session.close()
+
+    def _download(self, url, filepath, headers):
+        # The response once filepath is written, None on 304
+        attempt = 0
+        while True:
+            try:
+                response = self._session.get(url, headers=headers, stream=True,
+                                             timeout=self._timeout)
+                try:
+                    if response.status_code in _RETRY_STATUSES and attempt < self._retries:
+                        delay = _retry_after(response, self._backoff * 2 ** attempt)
+                    elif response.status_code == 304 and headers:
+                        return None
+                    else:
+                        response.raise_for_status()
+                        self._save(response, filepath)
+                        return response
+                finally:
+                    response.close()
+            except (requests.ConnectionError, requests.Timeout,
+                    requests.exceptions.ChunkedEncodingError):
+                if attempt >= self._retries:
+                    raise
+                delay = self._backoff * 2 ** attempt
+            time.sleep(delay)
+            attempt += 1
+
+    def _save(self, response, filepath):
+        # Written next to the target and renamed, so an interrupted
+        # download never leaves a truncated file behind
+        tmp = '{}.{}.part'.format(filepath, uuid.uuid4().hex)
+        try:
+            with open(tmp, 'wb') as fwrite:
+                for chunk in response.iter_content(self._chunk_size):
+                    fwrite.write(chunk)
+            os.replace(tmp, filepath)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+    def _host_slot(self, url):
+        host = urlparse(url).netloc
+        with self._lock:
+            slot = self._hosts.get(host)
+            if slot is None:
+                slot = self._hosts[host] = threading.BoundedSemaphore(self._per_host)
+        return slot
+
+
+class _MetadataStore(object):
+    # url -> {'path', 'etag', 'last_modified'}, rewritten on every change
+    def __init__(self, path):
+        self._path = path
+        self._lock = threading.Lock()
+        try:
+            with open(path, encoding='utf-8') as fread:
+                self._entries = json.load(fread)
+        except (OSError, ValueError):
+            self._entries = {}
+
+    def get(self, url):
+        with self._lock:
+            return self._entries.get(url)
+
+    def put(self, url, meta):
+        with self._lock:
+            self._entries[url] = meta
+            os.makedirs(os.path.dirname(self._path) or os.curdir, exist_ok=True)
+            tmp = '{}.{}.tmp'.format(self._path, uuid.uuid4().hex)
+            with open(tmp, 'w', encoding='utf-8') as fwrite:
+                json.dump(self._entries, fwrite, indent=1, sort_keys=True)
+            os.replace(tmp, self._path)
+
+
+def _retry_after(response, default):
+    # Only the delay-seconds form; never wait more than a minute
+    value = response.headers.get('Retry-After', '')
+    return min(float(value), 60.0) if value.isdigit() else default
@@ -0,0 +1,32 @@
+from pdfminer.layout import LTChar
+
+
+class LineFonts(object):
+    # Font facts of one text line, gathered in a single walk over its chars.
+    __slots__ = ('names', 'sizes', 'font', 'bold', 'italic', 'heavy')
+
+    def __init__(self, line):
+        names = set()
+        sizes = set()
+        font = None
+        for char in line._objs:
+            if isinstance(char, LTChar):
+                if font is None:
+                    font = char.fontname
+                names.add(char.fontname)
+                sizes.add(round(char.size, 0))
+
+        self.names = frozenset(names)
+        self.sizes = frozenset(sizes)
+        self.font = font
+        self.bold = "Bold" in font if font is not None else None
+        self.italic = ("Italic" in font or "Oblique" in font) if font is not None else None
+        # Bold or Black anywhere in the line
+        self.heavy = any('Bold' in name or 'Black' in name for name in names)
+
+
+def line_fonts(line):
+    fonts = getattr(line, 'fonts', None)
+    if fonts is None:
+        fonts = line.fonts = LineFonts(line)
+    return fonts
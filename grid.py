@@ -0,0 +1,159 @@
+try:
+    import numpy as np
+except ImportError:  # optional, Pile falls back to its own loops
+    np = None
+
+
+def numpy_available():
+    return np is not None
+
+
+class TableGrid(object):
+    # Vectorised version of the cell walk in Pile._gen_table_intermediate.
+    # Rules and texts become coordinate arrays once; rule coverage of every
+    # grid edge, the colspan/rowspan searches and the text-to-cell
+    # assignment are then mask operations over the whole grid. All float
+    # arithmetic is done in the same order as the Python path, so the
+    # intermediate comes out identical.
+    def __init__(self, verticals, horizontals, texts, distance):
+        self._distance = distance
+        self._texts = texts
+        self._vx0, self._vy0, self._vy1 = _coordinates(verticals, ('x0', 'y0', 'y1'))
+        self._hy0, self._hx0, self._hx1 = _coordinates(horizontals, ('y0', 'x0', 'x1'))
+        self._tx0, self._ty0, self._tx1, self._ty1 = _coordinates(texts, ('x0', 'y0', 'x1', 'y1'))
+
+    def intermediate(self, vertical_coor, horizontal_coor):
+        sd = self._distance
+        cols = np.array(vertical_coor, dtype=float)  # ascending
+        rows = np.array(horizontal_coor, dtype=float)  # descending
+        num_cols = len(cols) - 1
+        num_rows = len(rows) - 1
+        tops = rows[:-1]
+        bottoms = rows[1:]
+
+        # Rules count only at the exact coordinate, like RuleIndex
+        vcol = _match(cols, self._vx0)
+        hrow = _match(-rows, -self._hy0)
+
+        # A cell is kept when rules cover its left and top edges
+        left_exist = self._vertical_cover(vcol, bottoms + sd, tops - sd, num_cols + 1)
+        top_exist = _intervals(
+            hrow,
+            np.searchsorted(cols[:-1] + sd, self._hx0, 'left'),
+            np.searchsorted(cols[1:] - sd, self._hx1, 'right') - 1,
+            num_rows + 1, num_cols)
+        active = left_exist[:num_cols].T & top_exist[:num_rows]
+
+        # colspan: first column line right of the cell that covers its row
+        span_exist = self._vertical_cover(vcol, (bottoms + sd) + sd, (tops - sd) - sd, num_cols + 1)
+        col_idx = np.arange(num_cols + 1)
+        firsts = np.where(span_exist.T, col_idx, num_cols + 1)
+        firsts = np.minimum.accumulate(firsts[:, ::-1], axis=1)[:, ::-1][:, 1:]
+        colspans = np.where(firsts <= num_cols, firsts - col_idx[:num_cols], 1)
+
+        # Pile._fill_vertical_range asserts on rows too thin to search in
+        thin = ~((tops - sd) > (bottoms + sd))
+        ruled = np.nonzero(np.bincount(vcol[vcol >= 0], minlength=num_cols + 1))[0]
+        if len(ruled) and np.any(active & thin[:, None] & (col_idx[:num_cols] < ruled[-1])):
+            raise AssertionError
+
+        # rowspan: best[j, c] is the rightmost column line reached by a rule
+        # on row line j that starts at or before column line c
+        best = np.full((num_rows + 1, num_cols + 2), -1, dtype=np.int64)
+        starts = np.searchsorted((cols + sd) + sd, self._hx0, 'left')
+        stops = np.searchsorted((cols - sd) - sd, self._hx1, 'right') - 1
+        keep = hrow >= 0
+        np.maximum.at(best, (hrow[keep], starts[keep]), stops[keep])
+        best = np.maximum.accumulate(best, axis=1)
+
+        cell_rows, cell_cols = np.nonzero(active)
+        cell_rights = cell_cols + colspans[cell_rows, cell_cols]
+        # Most spans end on the next line, so only the cells still searching
+        # are looked at for each further row line
+        rowspans = np.ones(len(cell_rows), dtype=np.int64)
+        pending = np.arange(len(cell_rows))
+        span = 1
+        while len(pending):
+            lines = cell_rows[pending] + span
+            pending = pending[lines <= num_rows]
+            lines = cell_rows[pending] + span
+            hit = best[lines, cell_cols[pending]] >= cell_rights[pending]
+            # A match on the last row line counts as no span at all
+            done = pending[hit & (lines < num_rows)]
+            rowspans[done] = span
+            pending = pending[~hit]
+            span += 1
+
+        cell_texts = self._assign_texts(
+            cols[cell_cols], rows[cell_rows], cols[cell_rights], rows[cell_rows + rowspans])
+
+        intermediate = [[] for idx in range(num_rows)]
+        for row, colspan, rowspan, texts in zip(
+                cell_rows.tolist(), (cell_rights - cell_cols).tolist(), rowspans.tolist(), cell_texts):
+            cell = {}
+            cell['texts'] = texts
+            if colspan > 1:
+                cell['colspan'] = colspan
+            if rowspan > 1:
+                cell['rowspan'] = rowspan
+            intermediate[row].append(cell)
+        return intermediate
+
+    def _vertical_cover(self, vcol, lows, highs, num_lines):
+        # covered[c, r]: a rule on column line c has y0 <= lows[r] and
+        # highs[r] <= y1. Both bounds fall with r, so every rule covers a
+        # contiguous run of rows.
+        return _intervals(
+            vcol,
+            np.searchsorted(-highs, -self._vy1, 'left'),
+            np.searchsorted(-lows, -self._vy0, 'right') - 1,
+            num_lines, len(lows))
+
+    def _assign_texts(self, lefts, tops, rights, bottoms):
+        # Texts inside each cell (Pile._in_range), in their original order.
+        # Only texts whose y0 falls in a cell's band are tested, like
+        # TextIndex does for the Python path.
+        sd = self._distance
+        order = np.argsort(self._ty0, kind='stable')
+        keys = self._ty0[order]
+        firsts = np.searchsorted(keys, bottoms - sd, 'left')
+        counts = np.searchsorted(keys, tops + sd, 'right') - firsts
+        counts = np.maximum(counts, 0)
+
+        cells = np.repeat(np.arange(len(lefts)), counts)
+        offsets = np.cumsum(counts) - counts
+        found = order[np.repeat(firsts - offsets, counts) + np.arange(len(cells))]
+
+        x0, y0, x1, y1 = self._tx0[found], self._ty0[found], self._tx1[found], self._ty1[found]
+        inside = ((lefts[cells] - sd) <= x0) & (x0 < x1) & (x1 <= (rights[cells] + sd)) & \
+            ((bottoms[cells] - sd) <= y0) & (y0 < y1) & (y1 <= (tops[cells] + sd))
+        cells = cells[inside]
+        found = found[inside]
+        ordered = np.lexsort((found, cells))
+        cells = cells[ordered]
+        found = found[ordered].tolist()
+
+        bounds = np.searchsorted(cells, np.arange(len(lefts) + 1)).tolist()
+        return [[self._texts[pos] for pos in found[bounds[idx]:bounds[idx + 1]]]
+                for idx in range(len(lefts))]
+
+def _coordinates(objects, attrs):
+    return [np.array([getattr(obj, attr) for obj in objects], dtype=float) for attr in attrs]
+
+
+def _match(coors, values):
+    # Position of each value in the sorted, duplicate free coors, or -1
+    # when it is not exactly one of them.
+    pos = np.searchsorted(coors, values)
+    found = pos < len(coors)
+    found[found] = coors[pos[found]] == values[found]
+    return np.where(found, pos, -1)
+
+
+def _intervals(groups, starts, stops, num_groups, length):
+    # covered[g, i] is True when some [start, stop] of group g contains i
+    keep = (groups >= 0) & (starts <= stops)
+    marks = np.zeros((num_groups, length + 1), dtype=np.int64)
+    np.add.at(marks, (groups[keep], starts[keep]), 1)
+    np.add.at(marks, (groups[keep], stops[keep] + 1), -1)
+    return np.cumsum(marks, axis=1)[:, :length] > 0
@@ -0,0 +1,124 @@
+import hashlib
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pdfminer.image import ImageWriter
+
+
+class ImageExporter(object):
+    # Writes images from a background thread pool. Images with the same
+    # content (stream data and decoding parameters) are written once and
+    # every later occurrence gets the first one's name. Names are settled
+    # in the calling thread, so markdown can link an image right away while
+    # the file is still being encoded. Images must be detached
+    # (Pile.detach) first: the worker threads never touch the PDFDocument.
+    def __init__(self, directory, workers=4):
+        self._directory = directory
+        self._workers = workers
+        self._executor = None
+        self._pending = deque()
+        self._by_digest = {}
+        self._reserved = set()
+        self.names = []  # every file written, in first-seen order
+        self.duplicates = 0
+
+    def export(self, image):
+        digest = _image_digest(image)
+        name = self._by_digest.get(digest)
+        if name is not None:
+            self.duplicates += 1
+            return name
+
+        if self._executor is None:
+            os.makedirs(self._directory, exist_ok=True)
+            self._executor = ThreadPoolExecutor(max_workers=self._workers)
+        name = self._reserve(image, _probe_extension(image, self._directory))
+        self._by_digest[digest] = name
+        self.names.append(name)
+
+        self._pending.append(self._executor.submit(_export, self._directory, name, image))
+        # Bound the images held by queued tasks
+        while len(self._pending) > self._workers * 4:
+            self._pending.popleft().result()
+        return name
+
+    def close(self):
+        # Waits for all exports; the first failure is raised
+        if self._executor is None:
+            return
+        try:
+            while self._pending:
+                self._pending.popleft().result()
+        finally:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+            self._pending.clear()
+
+    def _reserve(self, image, ext):
+        # ImageWriter's naming scheme, decided up front. The name is claimed
+        # with an empty placeholder file right away: the image itself is
+        # written later, and other exporters (other processes, too) may be
+        # choosing names in the same directory meanwhile.
+        name = image.name + ext
+        idx = 0
+        while True:
+            if name not in self._reserved:
+                try:
+                    fd = os.open(os.path.join(self._directory, name),
+                                 os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                except FileExistsError:
+                    pass
+                else:
+                    os.close(fd)
+                    break
+            name = '{}.{}{}'.format(image.name, idx, ext)
+            idx += 1
+        self._reserved.add(name)
+        return name
+
+
+class _Extension(Exception):
+    pass
+
+
+class _ExtensionProbe(ImageWriter):
+    # Runs ImageWriter's choice of format without writing anything: every
+    # _save_* method asks for its file name before it opens the file.
+    def _create_unique_image_name(self, image, ext):
+        raise _Extension(ext)
+
+
+class _NamedImageWriter(ImageWriter):
+    def __init__(self, outdir, name):
+        ImageWriter.__init__(self, outdir)
+        self._name = name
+
+    def _create_unique_image_name(self, image, ext):
+        return self._name, os.path.join(self.outdir, self._name)
+
+
+def _export(directory, name, image):
+    # Fills the placeholder _reserve left; a failed export removes it
+    try:
+        _NamedImageWriter(directory, name).export_image(image)
+    except BaseException:
+        os.remove(os.path.join(directory, name))
+        raise
+
+
+def _probe_extension(image, directory):
+    try:
+        _ExtensionProbe(directory).export_image(image)
+    except _Extension as found:
+        return found.args[0]
+    raise Exception('Unsupported image: ' + image.name)
+
+
+def _image_digest(image):
+    stream = image.stream
+    digest = hashlib.sha256()
+    params = (image.srcsize, image.bits, image.imagemask, image.colorspace,
+              stream.get_filters())
+    digest.update(repr(params).encode('utf-8'))
+    digest.update(stream.get_data() or b'')
+    return digest.digest()
@@ -0,0 +1,75 @@
+import json
+import time
+from collections import Counter
+from collections import OrderedDict
+
+
+class Instrumentation(object):
+    # Timings and counters of one document's conversion. Parser and Writer
+    # call record() for every stage they run (per page where there is a
+    # page); each event is handed to the hooks right away and kept for
+    # report(). Components hold None instead of an Instrumentation when it
+    # is disabled and skip even reading the clock.
+    #
+    # An event is a dict: {'stage': ..., 'page': page number or None,
+    # 'seconds': wall time, 'counts': {name: number}}.
+    def __init__(self, name=None, hooks=None):
+        self.name = name
+        self.events = []
+        self._hooks = list(hooks) if hooks else []
+
+    def add_hook(self, hook):
+        self._hooks.append(hook)
+        return self
+
+    def clock(self):
+        return time.perf_counter()
+
+    def record(self, stage, seconds, page=None, **counts):
+        event = {
+            'stage': stage,
+            'page': page,
+            'seconds': seconds,
+            'counts': counts,
+        }
+        self._add(event)
+        return event
+
+    def replay(self, events):
+        # Events recorded elsewhere, e.g. by a worker process
+        for event in events:
+            self._add(event)
+
+    def report(self):
+        stages = OrderedDict()
+        pages = {}
+        counters = Counter()
+        for event in self.events:
+            stage = stages.setdefault(event['stage'], {'seconds': 0.0, 'calls': 0})
+            stage['seconds'] += event['seconds']
+            stage['calls'] += 1
+            counters.update(event['counts'])
+
+            if event['page'] is not None:
+                page = pages.setdefault(event['page'], {'seconds': 0.0, 'stages': {}, 'counts': {}})
+                page['seconds'] += event['seconds']
+                page['stages'][event['stage']] = page['stages'].get(event['stage'], 0.0) + event['seconds']
+                for key, value in event['counts'].items():
+                    page['counts'][key] = page['counts'].get(key, 0) + value
+
+        return {
+            'document': self.name,
+            'seconds': sum(stage['seconds'] for stage in stages.values()),
+            'stages': stages,
+            'counts': dict(counters),
+            'pages': [dict(page=num, **pages[num]) for num in sorted(pages)],
+        }
+
+    def write_report(self, filename):
+        with open(filename, 'w', encoding='utf-8') as fwrite:
+            json.dump(self.report(), fwrite, indent=2)
+
+    def _add(self, event):
+        self.events.append(event)
+        for hook in self._hooks:
+            hook(event)
@@ -2,15 +2,13 @@ import sys
 import os
 import re
 
-import requests
 from urllib.parse import urlparse, unquote
 from bs4 import BeautifulSoup
-import shutil
 import pdfplumber
 
-from parser import Parser
-from writer import Writer
-from syntax import UrbanSyntax
+from batch import BatchConverter, convert_pdf
+from cache import ConversionCache
+from fetch import Fetcher
 
 links = [
     "https://api.akbf.ru/file/download/d5d20ecb-f127-4b8b-890a-70d82a24376a.pdf",
@@ -98,7 +96,8 @@ links = [
     # "https://akbf.ru/education-block/faq/individual-investment-account-3"
 ]
 
-tmp_folder = 'docs'
+tmp_folder = 'docs'  # downloads are kept, only changed ones are fetched again
+cache_folder = 'cache'
 
 # def convert_pdf_to_md(filename):
 #     parser = Parser(filename)
@@ -118,29 +117,23 @@ tmp_folder = 'docs'
 #     return writer.get_location()
 
 def convert_pdf_to_md(filename):
-    filepath = os.path.join(tmp_folder, filename)
-    parser = Parser(filepath)
-    parser.extract()
-    piles = parser.parse()
-
-    syntax = UrbanSyntax()
+    location = convert_pdf(os.path.join(tmp_folder, filename))
 
-    writer = Writer()
-    writer.set_syntax(syntax)
-    writer.set_mode('simple')
-    writer.set_title(filepath.replace('.pdf', '')) # Name of file
-    writer.write(piles)
+    print('Your markdown is at', location)
 
-    print('Your markdown is at', writer.get_location())
+    return location
 
-    return writer.get_location()
+def download(url, filepath):
+    fetcher = Fetcher(os.path.join(tmp_folder, 'fetch.json'))
+    try:
+        fetcher.fetch(url, filepath)
+    finally:
+        fetcher.close()
 
 def extract_content_from_pdf(url, rect, show=False):
-    response = requests.get(url)
     filename = "PDF_" + os.path.basename(unquote(urlparse(url).path))
     filepath = os.path.join(tmp_folder, filename)
-    with open(filepath, "wb") as f:
-        f.write(response.content)
+    download(url, filepath)
 
     ### Конвертация ПДФ
     loc = convert_pdf_to_md(filename)
@@ -163,8 +156,10 @@ def extract_content_from_pdf(url, rect, show=False):
 
 
 def extract_content_from_url(url, show=False):
-    response = requests.get(url)
-    soup = BeautifulSoup(response.content, 'html.parser')
+    html_path = os.path.join(tmp_folder, "LINK_" + url.split('/')[-1] + ".html")
+    download(url, html_path)
+    with open(html_path, 'rb') as fread:
+        soup = BeautifulSoup(fread, 'html.parser')
     text = soup.get_text()
 
     if show:
@@ -179,17 +174,28 @@ def extract_content_from_url(url, show=False):
 
     return text
 
-def process_links(links):
+def process_links(links, download_workers=4, convert_workers=None):
     folder_path = tmp_folder
-    rect = [0, 40, 595, 802]
-    shutil.rmtree(folder_path, ignore_errors=True)
     os.makedirs(folder_path, exist_ok=True)
+
+    cache = ConversionCache(cache_folder)
+    fetcher = Fetcher(os.path.join(folder_path, 'fetch.json'), per_host=download_workers)
+    converter = BatchConverter(folder_path, download_workers, convert_workers,
+                               cache=cache, fetcher=fetcher)
+    try:
+        results = converter.run(links)
+    finally:
+        fetcher.close()
     data = []
-    for link in links:
-        if link.lower().endswith(".pdf"):
-            data.append(extract_content_from_pdf(link, rect))
+    for result in results:
+        if result['error'] is not None:
+            print('Failed to process', result['url'], result['error'])
+            data.append("")
+        elif result['location'] is not None:
+            print('Your markdown is at', result['location'])
+            data.append("")
         else:
-            data.append(extract_content_from_url(link))
+            data.append(result['content'])
     return data
 
 def remove_unwanted_line_breaks(text):
@@ -204,6 +210,7 @@ def remove_unwanted_line_breaks(text):
     return text
 
 
-process_links(links)
+if __name__ == '__main__':
+    process_links(links)
 
 
@@ -1,57 +1,548 @@
+import io
+import mmap
+import os
+import shutil
+import tempfile
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
 from pdfminer.pdfparser import PDFParser
 from pdfminer.pdfdocument import PDFDocument
 from pdfminer.pdfpage import PDFPage
+from pdfminer.pdftypes import PDFObjRef
+from pdfminer.pdftypes import dict_value
 from pdfminer.pdfinterp import PDFResourceManager
 from pdfminer.pdfinterp import PDFPageInterpreter
 from pdfminer.pdfdevice import PDFDevice
 from pdfminer.layout import LAParams
+from pdfminer.layout import LTChar
+from pdfminer.layout import LTFigure
 from pdfminer.converter import PDFPageAggregator
+from pdfminer.utils import fsplit
+from budget import BudgetExceeded
+from budget import SkippedPage
+from cache import FontCache
+from cache import LayoutLRU
+from instrument import Instrumentation
 from pile import Pile
 
 
 class Parser(object):
-    def __init__(self, filename):
-        self._document = self._read_file(filename)
+    # layout_mode 'boxes' runs pdfminer's full layout analysis, 'lines'
+    # stops once chars are grouped into text lines (see LineAggregator).
+    # layout_budget bounds the pages kept for parse(page_num) and
+    # parse_range(), which lay out only the pages they are asked for.
+    # instrumentation (an instrument.Instrumentation) gets per-page timings
+    # and object counts, from worker processes too.
+    # Fonts are shared through font_cache by every Parser of the process
+    # (worker processes each have their own) unless one is passed in.
+    #
+    # source is a path, the PDF itself as bytes, or a binary file object.
+    # A path is mapped with mmap, so the OS pages the file in as pdfminer
+    # reads it. A file object stays the caller's to close. Piles keep
+    # reading from the document (images, mostly), so close() the parser,
+    # or leave its with block, only once they are written.
+    #
+    # budget (a budget.Budget) bounds the work per page and per document.
+    # Pages over it are converted as text only or skipped; each case is
+    # listed in degraded as (page_num, limit, 'text_only' or 'skipped')
+    # and recorded as a 'degraded' event.
+    font_cache = FontCache()
+
+    def __init__(self, source, workers=None, layout_cache=None,
+                 laparams=None, layout_mode='boxes', layout_budget=64 * 1024 ** 2,
+                 instrumentation=None, font_cache=None, budget=None):
+        if layout_mode not in ('boxes', 'lines'):
+            raise Exception('No such layout mode')
+        self._budget = budget
+        self._deadline = None
+        if budget is not None and budget.document_seconds is not None:
+            # Wall clock, so worker processes can share it
+            self._deadline = time.time() + budget.document_seconds
+        self.degraded = []
+        self._filename = None
+        self._spill = None
+        self._fp, self._owns_fp = self._open_source(source)
+        self._workers = workers
+        self._layout_cache = layout_cache
+        self._digest_memo = {}
+        self._laparams = laparams if laparams is not None else LAParams()
+        self._layout_mode = layout_mode
+        self._instrumentation = instrumentation
+        if font_cache is not None:
+            self.font_cache = font_cache
+        try:
+            self._document = self._read_file(self._fp)
+        except BaseException:
+            self.close()
+            raise
         self._device, self._interpreter = self._prepare_tools()
+        self._text_tools = None
         self._pages = {}
+        self._parsed = {}
+        self._page_index = None
+        self._recent = LayoutLRU(layout_budget)
 
         self._HTML_DEBUG = True
 
     def extract(self, max_page_num=None):
-        for page in PDFPage.create_pages(self._document):
-            self._interpreter.process_page(page)
-            layout = self._device.get_result()
+        if self._is_parallel():
+            for page_num, piles in self._iter_parallel(max_page_num):
+                self._parsed[page_num] = piles
+            return
 
-            if max_page_num != None and layout.pageid > max_page_num:
-                break
+        for page_num, page in self._iter_laid_out(0, max_page_num):
+            self._pages[page_num] = page
 
-            self._pages[layout.pageid] = layout
+    def iter_piles(self, max_page_num=None):
+        # Streaming counterpart of extract() + parse(): each page is
+        # interpreted, split into piles and dropped before the next one,
+        # so memory stays flat no matter how many pages there are.
+        if self._is_parallel():
+            for page_num, piles in self._iter_parallel(max_page_num):
+                for pile in piles:
+                    yield pile
+            return
+
+        for page_num, page in self._iter_laid_out(0, max_page_num):
+            piles = self._parse_page(page, page_num)
+            del page
+            for pile in piles:
+                yield pile
 
     def parse(self, page_num=None):
         piles = []
         if page_num == None:
             for page_num, page in list(self._pages.items()):
-                piles += self._parse_page(page)
-        else:
+                piles += self._parse_page(page, page_num)
+            for page_num, page_piles in list(self._parsed.items()):
+                piles += page_piles
+        elif page_num in self._parsed:
+            piles = list(self._parsed[page_num])
+        elif page_num in self._pages:
             page = self._pages[page_num]
-            piles = self._parse_page(page)
+            piles = self._parse_page(page, page_num)
+        else:
+            piles = self._parse_page(self._load_page(page_num), page_num)
+        return piles
+
+    def parse_range(self, first, last):
+        # Piles of pages first .. last (1-based, inclusive); pages before
+        # first are never interpreted.
+        piles = []
+        for page_num in range(first, last + 1):
+            piles += self.parse(page_num)
         return piles
 
-    def _read_file(self, filename):
-        parser = PDFParser(open(filename, 'rb'))
+    def get_page_count(self):
+        return len(self._get_page_index())
+
+    def close(self):
+        if self._owns_fp:
+            self._fp.close()
+        if self._spill is not None:
+            os.remove(self._spill)
+            self._spill = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _open_source(self, source):
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            return io.BytesIO(source), True
+        if hasattr(source, 'read'):
+            return source, False
+        self._filename = source
+        fread = open(source, 'rb')
+        if os.fstat(fread.fileno()).st_size == 0:
+            # An empty file cannot be mapped; PDFDocument rejects it anyway
+            return fread, True
+        with fread:
+            return mmap.mmap(fread.fileno(), 0, access=mmap.ACCESS_READ), True
+
+    def _read_file(self, fp):
+        parser = PDFParser(fp)
         document = PDFDocument(parser)
         return document
 
+    def _get_filename(self):
+        # Worker processes open the document by name; input that came from
+        # memory is written to a temporary file once for them
+        if self._filename is not None:
+            return self._filename
+        if self._spill is None:
+            position = self._fp.tell()
+            fd, spill = tempfile.mkstemp(suffix='.pdf')
+            with os.fdopen(fd, 'wb') as fwrite:
+                self._fp.seek(0)
+                shutil.copyfileobj(self._fp, fwrite)
+            self._fp.seek(position)
+            self._spill = spill
+        return self._spill
+
     def _prepare_tools(self):
-        laparams = LAParams()
-        rsrcmgr = PDFResourceManager()
-        device = PDFPageAggregator(rsrcmgr, laparams=laparams)
+        rsrcmgr = FontSharingManager(self.font_cache, self._digest_memo)
+        if self._budget is not None:
+            if self._layout_mode == 'lines':
+                device = _BudgetedLineAggregator(rsrcmgr, laparams=self._laparams)
+            else:
+                device = _BudgetedPageAggregator(rsrcmgr, laparams=self._laparams)
+        elif self._layout_mode == 'lines':
+            device = LineAggregator(rsrcmgr, laparams=self._laparams)
+        else:
+            device = PDFPageAggregator(rsrcmgr, laparams=self._laparams)
         interpreter = PDFPageInterpreter(rsrcmgr, device)
 
         return device, interpreter
 
-    def _parse_page(self, page):
+    def _get_text_tools(self):
+        # For pages over budget; shares the fonts with the main tools
+        if self._text_tools is None:
+            rsrcmgr = self._interpreter.rsrcmgr
+            device = _TextOnlyAggregator(rsrcmgr, laparams=self._laparams)
+            self._text_tools = device, PDFPageInterpreter(rsrcmgr, device)
+        return self._text_tools
+
+    def _iter_laid_out(self, start, stop):
+        # Yields (page_num, pile) for pages start+1 .. stop (1-based), each
+        # pile holding the page's primitives collected by parse_layout.
+        if stop != None and stop < start:
+            return
+        pages = islice(PDFPage.create_pages(self._document), start, stop)
+        for page_num, page in enumerate(pages, start + 1):
+            yield page_num, self._lay_out(page, page_num=page_num)
+
+    def _get_page_index(self):
+        # Walks the page tree only; no content stream is interpreted until
+        # a page is laid out.
+        if self._page_index is None:
+            self._page_index = list(PDFPage.create_pages(self._document))
+        return self._page_index
+
+    def _load_page(self, page_num):
+        pile = self._recent.get(page_num)
+        if pile is not None:
+            return pile
+
+        index = self._get_page_index()
+        if not 1 <= page_num <= len(index):
+            raise Exception('No such page: {}'.format(page_num))
+        pile = self._lay_out(index[page_num - 1], page_num)
+        self._recent.put(page_num, pile)
+        return pile
+
+    def _lay_out(self, page, page_num=None):
+        instrumentation = self._instrumentation
+        key = None
+        if self._deadline is not None and time.time() > self._deadline:
+            return self._skip_page(page_num, 'document_seconds', 0.0)
+        if self._layout_cache is not None:
+            if instrumentation is not None:
+                started = instrumentation.clock()
+            key = self._layout_cache.page_key(page, self._laparams, self._digest_memo,
+                                              self._layout_mode)
+            pile = self._layout_cache.load(key)
+            if pile is not None:
+                if instrumentation is not None:
+                    self._record_layout('layout_cache', started, page_num, pile)
+                return self._check_rules(pile, page_num)
+
+        if instrumentation is not None:
+            started = instrumentation.clock()
+        degraded = len(self.degraded)
+        abandoned = 0.0
+        if self._budget is None:
+            self._interpreter.process_page(page)
+            layout = self._device.get_result()
+        else:
+            layout, abandoned = self._interpret_in_budget(page, page_num)
+            if layout is None:
+                return SkippedPage(page_num, self.degraded[-1][1])
+        if instrumentation is not None:
+            # The abandoned full layout is already in the 'degraded' event
+            seconds = instrumentation.clock() - started - abandoned
+            instrumentation.record('interpret', seconds, page_num)
+            started = instrumentation.clock()
         pile = Pile()
-        pile.parse_layout(page)
-        piles = pile.split_piles()
+        pile.parse_layout(layout)
+        if instrumentation is not None:
+            self._record_layout('parse_layout', started, page_num, pile)
+
+        # A text-only layout is not what the page looks like
+        if key is not None and len(self.degraded) == degraded:
+            self._layout_cache.save(key, pile.detach())
+        return self._check_rules(pile, page_num)
+
+    def _interpret_in_budget(self, page, page_num):
+        # (layout, seconds spent on an abandoned full layout). The layout
+        # is text only if the full one is over budget, or None when even
+        # that is; the 'degraded' event gets the time that was thrown away.
+        started = time.perf_counter()
+        try:
+            self._device.start_budget(self._budget)
+            self._interpreter.process_page(page)
+            return self._device.get_result(), 0.0
+        except BudgetExceeded as e:
+            limit = e.limit
+        abandoned = time.perf_counter() - started
+
+        device, interpreter = self._get_text_tools()
+        try:
+            device.start_budget(self._budget)
+            interpreter.process_page(page)
+        except BudgetExceeded:
+            self._degrade(page_num, limit, 'skipped', time.perf_counter() - started)
+            return None, 0.0
+        self._degrade(page_num, limit, 'text_only', abandoned)
+        return device.get_result(), abandoned
+
+    def _check_rules(self, pile, page_num):
+        # Tables are rebuilt from the rules; too many of them and the page
+        # is read as paragraphs instead
+        budget = self._budget
+        if budget is None or budget.table_rules is None:
+            return pile
+        if len(pile.verticals) + len(pile.horizontals) <= budget.table_rules:
+            return pile
+        self._degrade(page_num, 'table_rules', 'text_only', 0.0)
+        text_pile = Pile()
+        text_pile.texts = pile.texts
+        text_pile.images = pile.images
+        return text_pile
+
+    def _skip_page(self, page_num, limit, seconds):
+        self._degrade(page_num, limit, 'skipped', seconds)
+        return SkippedPage(page_num, limit)
+
+    def _degrade(self, page_num, limit, action, seconds):
+        self.degraded.append((page_num, limit, action))
+        if self._instrumentation is not None:
+            self._instrumentation.record('degraded', seconds, page_num,
+                                         **{action: 1, limit: 1})
+
+    def _record_layout(self, stage, started, page_num, pile):
+        seconds = self._instrumentation.clock() - started
+        self._instrumentation.record(
+            stage, seconds, page_num, texts=len(pile.texts), verticals=len(pile.verticals),
+            horizontals=len(pile.horizontals), images=len(pile.images))
+
+    def _parse_page(self, page, page_num=None):
+        if self._instrumentation is None:
+            return page.split_piles()
+
+        started = self._instrumentation.clock()
+        piles = page.split_piles()
+        seconds = self._instrumentation.clock() - started
+        types = [pile.get_type() for pile in piles]
+        self._instrumentation.record(
+            'split_piles', seconds, page_num, tables=types.count('table'),
+            paragraphs=types.count('paragraph'))
         return piles
+
+    def _is_parallel(self):
+        return self._workers != None and self._workers > 1
+
+    def _iter_parallel(self, max_page_num):
+        # Page numbers are 1-based, exactly like LTPage.pageid in serial mode.
+        # The page tree is walked once, here; each chunk gets the object ids
+        # of its pages and the worker builds just those (_resolve_page).
+        pageids = [page.pageid for page in self._get_page_index()[:max_page_num]]
+        num_pages = len(pageids)
+        if not num_pages:
+            return
+
+        # Several chunks per worker keep the pool busy when some page
+        # ranges are much heavier than others.
+        chunk = max(1, -(-num_pages // (self._workers * 4)))
+        ranges = [(start, min(start + chunk, num_pages))
+                  for start in range(0, num_pages, chunk)]
+
+        workers = min(self._workers, len(ranges))
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            pending = deque()
+            for start, stop in ranges:
+                pending.append(executor.submit(
+                    _parse_page_range, self._get_filename(), start, pageids[start:stop],
+                    self._layout_cache, self._laparams, self._layout_mode,
+                    self._instrumentation is not None, self._budget, self._deadline))
+                # Bound the number of finished-but-unconsumed chunks.
+                if len(pending) >= workers * 2:
+                    for result in self._collect(pending.popleft()):
+                        yield result
+            while pending:
+                for result in self._collect(pending.popleft()):
+                    yield result
+
+    def _collect(self, future):
+        results, events, degraded = future.result()
+        self.degraded += degraded
+        if self._instrumentation is not None:
+            self._instrumentation.replay(events)
+        return results
+
+    def _parse_pages(self, start, pageids):
+        results = []
+        for page_num, pageid in enumerate(pageids, start + 1):
+            page = self._lay_out(_resolve_page(self._document, pageid), page_num)
+            piles = [pile.detach() for pile in self._parse_page(page, page_num)]
+            results.append((page_num, piles))
+        events = self._instrumentation.events if self._instrumentation is not None else []
+        return results, events, self.degraded
+
+
+class FontSharingManager(PDFResourceManager):
+    # PDFResourceManager caches fonts by object id, i.e. for one document.
+    # Fonts seen for the first time are looked up in a FontCache by content
+    # as well, so another document's identical font is reused. memo is
+    # the document's digest memo (see LayoutCache.page_key).
+    def __init__(self, font_cache, memo):
+        PDFResourceManager.__init__(self)
+        self._font_cache = font_cache
+        self._memo = memo
+
+    def get_font(self, objid, spec):
+        if not objid or objid in self._cached_fonts or not self._font_cache.max_fonts:
+            return PDFResourceManager.get_font(self, objid, spec)
+
+        key = self._font_cache.font_key(spec, self._memo)
+        font = self._font_cache.get(key)
+        if font is None:
+            font = PDFResourceManager.get_font(self, objid, spec)
+            self._font_cache.put(key, font)
+        else:
+            self._cached_fonts[objid] = font
+        return font
+
+
+class LineAggregator(PDFPageAggregator):
+    # Layout analysis cut down to what Pile.parse_layout uses: chars are
+    # grouped into text lines, rects and images pass through untouched.
+    # pdfminer would go on to group the lines into text boxes and order
+    # the boxes hierarchically (the costly part on table-heavy pages), only
+    # for parse_layout to flatten them again. Lines keep the order in
+    # which the page draws them.
+    def end_page(self, page):
+        assert not self._stack, str(len(self._stack))
+        self.cur_item._objs = _group_lines(self.cur_item, self.laparams)
+        self.pageno += 1
+        self.receive_layout(self.cur_item)
+
+
+class _BudgetedDevice(object):
+    # Mixed into the aggregators when a Parser has a budget: counts what
+    # the page draws and aborts it with BudgetExceeded past the page's
+    # object count or time. The clock is read every _CLOCK_EVERY objects.
+    _CLOCK_EVERY = 256
+
+    def start_budget(self, budget):
+        self._max_objects = budget.page_objects
+        self._page_deadline = None
+        if budget.page_seconds is not None:
+            self._page_deadline = time.perf_counter() + budget.page_seconds
+        self._objects = 0
+        self._ticks = 0
+
+    def begin_page(self, page, ctm):
+        self._stack = []  # an aborted page leaves its figures open
+        super().begin_page(page, ctm)
+
+    def end_page(self, page):
+        self._check_clock()
+        super().end_page(page)
+
+    def render_char(self, *args):
+        self._spend()
+        return super().render_char(*args)
+
+    def paint_path(self, *args):
+        self._spend()
+        super().paint_path(*args)
+
+    def render_image(self, *args):
+        self._spend()
+        super().render_image(*args)
+
+    def _spend(self):
+        self._objects += 1
+        if self._max_objects is not None and self._objects > self._max_objects:
+            raise BudgetExceeded('page_objects')
+        self._tick()
+
+    def _tick(self):
+        self._ticks += 1
+        if self._ticks % self._CLOCK_EVERY == 0:
+            self._check_clock()
+
+    def _check_clock(self):
+        if self._page_deadline is not None and time.perf_counter() > self._page_deadline:
+            raise BudgetExceeded('page_seconds')
+
+
+class _BudgetedPageAggregator(_BudgetedDevice, PDFPageAggregator):
+    pass
+
+
+class _BudgetedLineAggregator(_BudgetedDevice, LineAggregator):
+    pass
+
+
+class _TextOnlyAggregator(_BudgetedDevice, LineAggregator):
+    # The cheap path for pages over budget: paths (rules, vector art) are
+    # dropped as they are painted and text is only grouped into lines
+    def paint_path(self, *args):
+        self._tick()
+
+
+def _group_lines(container, laparams):
+    chars, others = fsplit(lambda obj: isinstance(obj, LTChar), container)
+    for obj in others:
+        # Like pdfminer, text inside figures is left as chars unless all_texts
+        if isinstance(obj, LTFigure) and laparams.all_texts:
+            obj._objs = _group_lines(obj, laparams)
+    if not chars:
+        return others
+
+    lines = list(container.group_objects(laparams, chars))
+    for line in lines:
+        line.analyze(laparams)  # appends the line terminator
+    # Whitespace-only lines go last, as in pdfminer's own analysis
+    empties, lines = fsplit(lambda obj: obj.is_empty(), lines)
+    return lines + others + empties
+
+
+def _parse_page_range(filename, start, pageids, layout_cache=None,
+                      laparams=None, layout_mode='boxes', instrument=False,
+                      budget=None, deadline=None):
+    # Runs in a worker process: every worker opens its own PDFDocument.
+    # Its events are sent back and replayed into the parent's hooks.
+    # deadline is the parent's, so the document budget covers all workers.
+    with Parser(filename, layout_cache=layout_cache, laparams=laparams,
+                layout_mode=layout_mode,
+                instrumentation=Instrumentation() if instrument else None,
+                budget=budget) as parser:
+        parser._deadline = deadline
+        return parser._parse_pages(start, pageids)
+
+
+def _resolve_page(document, pageid):
+    # The PDFPage that PDFPage.create_pages yields for this page object,
+    # without walking the page tree down to it: inherited attributes are
+    # looked up along the /Parent chain instead.
+    attrs = dict_value(document.getobj(pageid)).copy()
+    node = attrs
+    seen = {pageid}
+    while isinstance(node.get('Parent'), PDFObjRef) and node['Parent'].objid not in seen:
+        seen.add(node['Parent'].objid)
+        node = dict_value(node['Parent'].resolve())
+        for key in PDFPage.INHERITABLE_ATTRS:
+            if key not in attrs and key in node:
+                attrs[key] = node[key]
+    if 'Pages' in document.catalog:
+        for key in PDFPage.INHERITABLE_ATTRS:
+            if key not in attrs and key in document.catalog:
+                attrs[key] = document.catalog[key]
+    return PDFPage(document, pageid, attrs, None)
@@ -1,4 +1,3 @@
-from typing import Any
 from pdfminer.layout import LTFigure
 from pdfminer.layout import LTTextBox
 from pdfminer.layout import LTTextLine
@@ -10,17 +9,60 @@ from pdfminer.layout import LTImage
 from pdfminer.layout import LTCurve
 from pdfminer.layout import LTChar
 from pdfminer.layout import LTLine
+from pdfminer.pdftypes import PDFStream
+from pdfminer.pdftypes import resolve1
+from pdfminer.psparser import LIT
+from pdfminer.psparser import PSLiteral
+from fonts import line_fonts
+from grid import TableGrid
+from grid import numpy_available
+from postprocess import paragraph_postprocessor
+from records import Image
+from records import Rule
+from records import TextLine
+from spatial import BandIndex
+from spatial import RuleIndex
+from spatial import SnapIndex
+from spatial import TextIndex
+from spatial import cluster_by_y
 import binascii
+import copyreg
 import re
 
 
+def _intern_literal(name):
+    return LIT(name)
+
+
+_UPPER_NUMBERED_RE = re.compile(r'^(\s|)\d+\.')
+_SECTION_RE = re.compile(r'^Раздел ')
+_NUMBERED_RE = re.compile(r'^(\s|)\d+\.\s')
+_SUBNUMBERED_RE = re.compile(r'^(\s|)(\d+\.){2}(\s{1}|\s{0}$)')
+_DASHED_RE = re.compile(r'^\D+–')
+_SUBSUBNUMBERED_RE = re.compile(r'^\d+\.\d+\.\d+.')
+
+_PARAGRAPH_POSTPROCESSOR = paragraph_postprocessor()
+
+
+# pdfminer compares literals by identity, so unpickled ones must be interned
+copyreg.pickle(PSLiteral, lambda literal: (_intern_literal, (literal.name,)))
+
+
 class Pile(object):
+    # How table grids are built: 'numpy' uses the vectorised TableGrid,
+    # 'python' the loops in _gen_table_intermediate, and 'auto' the former
+    # for tables with at least _TABLE_GRID_CELLS cells when NumPy is there.
+    table_engine = 'auto'
+    _TABLE_GRID_CELLS = 100
+
     def __init__(self):
         self.verticals = []
         self.horizontals = []
         self.texts = []
         self.images = []
         self._SEARCH_DISTANCE = 1.0
+        self._rule_indexes = None
+        self._text_index = None
 
     def __bool__(self):
         return bool(self.texts)
@@ -34,36 +76,32 @@ class Pile(object):
             return 'paragraph'
 
     def parse_layout(self, layout):
+        vertical_snaps = self._build_snap_index(self.verticals, 'x0')
+        horizontal_snaps = self._build_snap_index(self.horizontals, 'y0')
+
         obj_stack = list(reversed(list(layout)))
         while obj_stack:
             obj = obj_stack.pop()
             if type(obj) in [LTFigure, LTTextBox, LTTextLine, LTTextBoxHorizontal]:
                 obj_stack.extend(reversed(list(obj)))
             elif type(obj) == LTTextLineHorizontal:
-                try:
-                    if len(list(obj)):
-                        font = font
-                        obj.bold = "Bold" in font
-                        obj.italic = "Italic" in font or "Oblique" in font
-                        obj.font = font
-                except:
-                    obj.font = None
-                    obj.bold = None
-                    obj.italic = None
-
-                obj.chars = len(list(obj))
-                obj.size = round(obj.height, 0)
-                self.texts.append(obj)
-                
+                # Keep compact records instead of pdfminer objects, so the
+                # chars (and everything they reference) can be freed.
+                self.texts.append(TextLine(obj, line_fonts(obj)))
+
             elif type(obj) == LTRect:
                 if obj.width < 1.0:
-                    self._adjust_to_close(obj, self.verticals, 'x0')
-                    self.verticals.append(obj)
+                    rule = Rule(obj.bbox)
+                    self._adjust_to_close(rule, vertical_snaps, 'x0')
+                    self.verticals.append(rule)
+                    vertical_snaps.add(rule.x0, rule)
                 elif obj.height < 1.0:
-                    self._adjust_to_close(obj, self.horizontals, 'y0')
-                    self.horizontals.append(obj)
+                    rule = Rule(obj.bbox)
+                    self._adjust_to_close(rule, horizontal_snaps, 'y0')
+                    self.horizontals.append(rule)
+                    horizontal_snaps.add(rule.y0, rule)
             elif type(obj) == LTImage:
-                self.images.append(obj)
+                self.images.append(Image(obj))
             elif type(obj) == LTCurve:
                 pass
             elif type(obj) == LTChar:
@@ -155,14 +193,28 @@ class Pile(object):
             raise Exception('No images here')
         return self.images[0]
 
-    def _adjust_to_close(self, obj, lines, attr):
-        obj_coor = getattr(obj, attr)
-        close = None
+    def detach(self):
+        # Make the pile self-contained so it can be pickled (e.g. returned
+        # from a worker process): image streams are decoded up front and
+        # every indirect reference back to the PDFDocument is resolved.
+        for image in self.images:
+            memo = {}
+            image.stream = _detach_object(image.stream, memo)
+            image.colorspace = _detach_object(image.colorspace, memo)
+            image.srcsize = tuple(resolve1(size) for size in image.srcsize)
+            image.imagemask = resolve1(image.imagemask)
+            image.bits = resolve1(image.bits)
+        return self
+
+    def _build_snap_index(self, lines, attr):
+        snaps = SnapIndex(self._SEARCH_DISTANCE)
         for line in lines:
-            line_coor = getattr(line, attr)
-            if abs(obj_coor - line_coor) < self._SEARCH_DISTANCE:
-                close = line
-                break
+            snaps.add(getattr(line, attr), line)
+        return snaps
+
+    def _adjust_to_close(self, obj, snaps, attr):
+        # The first collected line within _SEARCH_DISTANCE wins.
+        close = snaps.find(getattr(obj, attr))
 
         if not close:
             return
@@ -176,26 +228,18 @@ class Pile(object):
         obj.set_bbox(new_bbox)
 
     def _find_tables(self):
-        tables = []
-        visited = set()
-        for vertical in self.verticals:
-            if vertical in visited:
-                continue
-
-            near_verticals = self._find_near_verticals(
-                vertical, self.verticals)
-            top, bottom = self._calc_top_bottom(near_verticals)
-            included_horizontals = self._find_included(
-                top, bottom, self.horizontals)
-            included_texts = self._find_included(top, bottom, self.texts)
+        clusters = cluster_by_y(self.verticals, self._SEARCH_DISTANCE)
+        bands = [self._calc_top_bottom(cluster) for cluster in clusters]
+        included_horizontals = self._find_included(bands, self.horizontals)
+        included_texts = self._find_included(bands, self.texts)
 
+        tables = []
+        for idx, near_verticals in enumerate(clusters):
             table = Pile()
             table.verticals = near_verticals
-            table.horizontals = included_horizontals
-            table.texts = included_texts
-
+            table.horizontals = included_horizontals[idx]
+            table.texts = included_texts[idx]
             tables.append(table)
-            visited.update(near_verticals)
         return tables
 
     def _find_paragraphs(self, tables):
@@ -239,11 +283,6 @@ class Pile(object):
             return self.images[0]
         raise Exception('The pile contains nothing')
 
-    def _is_overlap(self, top, bottom, obj):
-        assert top > bottom
-        return (bottom - self._SEARCH_DISTANCE) <= obj.y0 <= (top + self._SEARCH_DISTANCE) or \
-            (bottom - self._SEARCH_DISTANCE) <= obj.y1 <= (top + self._SEARCH_DISTANCE)
-
     def _calc_top_bottom(self, objects):
         top = float('-inf')
         bottom = float('inf')
@@ -252,40 +291,33 @@ class Pile(object):
             bottom = min(bottom, obj.y0)
         return top, bottom
 
-    def _find_near_verticals(self, start, verticals):
-        near_verticals = [start]
-        top = start.y1
-        bottom = start.y0
-        for vertical in verticals:
-            if vertical == start:
-                continue
-            if self._is_overlap(top, bottom, vertical):
-                near_verticals.append(vertical)
-                top, bottom = self._calc_top_bottom(near_verticals)
-        return near_verticals
-
-    def _find_included(self, top, bottom, objects):
-        included = []
+    def _find_included(self, bands, objects):
+        # An object belongs to every (top, bottom) band that one of its ends
+        # falls into, give or take _SEARCH_DISTANCE.
+        index = BandIndex(bands, self._SEARCH_DISTANCE)
+        included = [[] for band in bands]
         for obj in objects:
-            if self._is_overlap(top, bottom, obj):
-                included.append(obj)
+            for idx in index.containing(obj.y0, obj.y1):
+                included[idx].append(obj)
         return included
 
     def _gen_paragraph_markdown(self, syntax):
-        markdown = ''
+        parts = []
+        # Beginning of the markdown line being written. Only its prefix is
+        # ever checked, so the accumulated text never has to be re-split.
         prevtext = ''
 
-        font_names: set[Any] = {char.fontname for line in self.texts for char in line._objs if isinstance(char, LTChar)} 
-        font_sizes: set[float] = {round(char.size,0) for line in self.texts for char in line._objs if isinstance(char, LTChar)}
+        # Per-line font facts were gathered once in parse_layout
+        lines_fonts = [line_fonts(line) for line in self.texts]
+        font_sizes: set[float] = set().union(*(fonts.sizes for fonts in lines_fonts))
         max_font_size: float = max(font_sizes)
         min_font_size: float = min(font_sizes)
+        is_bold: bool = any(fonts.heavy for fonts in lines_fonts)
 
         for text in self.texts:
-            pattern = syntax.pattern(text)
-            newline = syntax.newline(text)
-            content = syntax.purify(text)
+            line = text.get_text()
+            pattern, newline, content = syntax.classify(text)
 
-            is_bold: bool = any('Bold' in name or 'Black' in name for name in font_names)
             # print(f'<< {content}')
 
             # markdown = re.sub(r'\n\s(\d+.\d+.)', r'\n\1', markdown)
@@ -293,11 +325,13 @@ class Pile(object):
             
             if 'heading' in pattern:
                 if prevtext.startswith('#'):
-                    markdown += '\n'
+                    parts.append('\n')
+                    prevtext = ''
             
             if pattern == 'none':
                 if prevtext.startswith('#'):
-                    markdown += '\n'
+                    parts.append('\n')
+                    prevtext = ''
             #     continue
             # elif pattern.startswith('heading'):
             #     lead = '#' * int(pattern[-1])
@@ -313,46 +347,42 @@ class Pile(object):
             # else:
             #     raise Exception('Unsupported syntax pattern')
             
-            if text.get_text().isupper() and re.match(r'^(\s|)\d+\.', text.get_text()) : 
-                markdown += f"## {text.get_text()}"
-            elif text.get_text().isupper() and text.size == max_font_size or\
-                text.get_text().isupper() and is_bold: 
-                markdown += f"# {text.get_text()}"
-            elif is_bold and re.match(r'^Раздел ', text.get_text()) or \
-                    is_bold and text.size > min_font_size and re.match(r'^(\s|)\d+\.\s', text.get_text()):
-                markdown += f"### {text.get_text()}"
-            elif re.match(r'^(\s|)(\d+\.){2}(\s{1}|\s{0}$)', text.get_text()):
-                markdown += f"#### {text.get_text()}"
-            elif is_bold and text.size > min_font_size and re.match(r'^\D+–', text.get_text()):
-                markdown += f"- {text.get_text()}"
-            elif re.match(r'^\d+\.\d+\.\d+.', text.get_text()):
-                markdown += f"- {text.get_text()}"
+            is_upper = line.isupper()
+            if is_upper and _UPPER_NUMBERED_RE.match(line) : 
+                fragment = f"## {line}"
+            elif is_upper and text.size == max_font_size or\
+                is_upper and is_bold: 
+                fragment = f"# {line}"
+            elif is_bold and _SECTION_RE.match(line) or \
+                    is_bold and text.size > min_font_size and _NUMBERED_RE.match(line):
+                fragment = f"### {line}"
+            elif _SUBNUMBERED_RE.match(line):
+                fragment = f"#### {line}"
+            elif is_bold and text.size > min_font_size and _DASHED_RE.match(line):
+                fragment = f"- {line}"
+            elif _SUBSUBNUMBERED_RE.match(line):
+                fragment = f"- {line}"
             else:
-                markdown += text.get_text()
+                fragment = line
 
             if newline:
                 # markdown.strip()
                 # markdown = '\n' + markdown + '\n'
-                markdown += '\n'
+                fragment += '\n'
+
+            parts.append(fragment)
+            if '\n' in fragment:
+                prevtext = fragment[fragment.rfind('\n') + 1:]
+            elif not prevtext:
+                prevtext = fragment
 
-            prevtext = markdown.split('\n')[-1]
+        markdown = ''.join(parts)
 
         ###
-        # Удаляет цифру в конце строки, если затем идет перенос строки
-        markdown = re.sub(r'[^\d+]\d{1,2}\s+\n', '\n', markdown)        
-        markdown = re.sub(r'[^\d+]\d{1,2}\s+\n$', '\n', markdown)
-        # Удаление случаев, когда есть пробел, перенос строки, и сразу за переносом идет маленькая буква
-        markdown = re.sub(r'\ +', ' ', markdown)
-        markdown = re.sub('\n{2,10}', '\n', markdown)
-        markdown = re.sub(r"", ">", markdown)
-        markdown = re.sub(r" \n(?=[а-я0-9\(\«)])", " ", markdown)
-        markdown = re.sub(r"(?<=[\–]) \n(?=[А-Я\(\-])", " ", markdown)
-        markdown = re.sub(r"(?<=[\>\-]) \n", " ", markdown)
-        # Удаление переноса строки между строками, начинающимися с '# '
-        markdown = re.sub(r'\n#(?=\s)', '', markdown)
-        # Удаление переноса строки где он идет сразу после установки пунктов (1., 1.2)
-        markdown = re.sub(r'(\#{1}\s(\d+\.){0,3}\s)\n', r'\1', markdown)
-        markdown = re.sub(r'\sстр. \d+ из', '', markdown) 
+        postprocessor = getattr(syntax, 'postprocessor', None)
+        if postprocessor is None:
+            postprocessor = _PARAGRAPH_POSTPROCESSOR
+        markdown = postprocessor.apply(markdown)
 
         # Дальнейшие правила для обработки текста
         # text = re.sub(r'(?<!\.\n)(?<!\n\n)(?<!\.\s)\n(?=[A-ZА-Я])', ' ', text)
@@ -430,17 +460,13 @@ class Pile(object):
                     continue
                 if coor.x0 < min(vertical_coor) - self._SEARCH_DISTANCE:
                     if ly0 and ly1:
-                        new_object = LTRect(linewidth=0,
-                                            bbox=(round(lx, 3), ly0, round(lx + self._SEARCH_DISTANCE/2, 3), round(coor.y1, 3)),
-                                            stroke=False)
+                        new_object = Rule((round(lx, 3), ly0, round(lx + self._SEARCH_DISTANCE/2, 3), round(coor.y1, 3)))
                         self.verticals.append(new_object)
                     ly0 = round(coor.y0, 3)
                     ly1 = round(coor.y1, 3)
                 if coor.x1 > max(vertical_coor) + self._SEARCH_DISTANCE:
                     if ry0 and ry1:
-                        new_object = LTRect(linewidth=0,
-                                            bbox=(round(rx, 3), ry0, round(rx + self._SEARCH_DISTANCE/2, 3), round(coor.y1, 3)),
-                                            stroke=False)
+                        new_object = Rule((round(rx, 3), ry0, round(rx + self._SEARCH_DISTANCE/2, 3), round(coor.y1, 3)))
                         self.verticals.append(new_object)
                     ry0 = round(coor.y0, 3)
                     ry1 = round(coor.y1, 3)
@@ -457,6 +483,12 @@ class Pile(object):
         # print(f'V.coor: {vertical_coor}, H.coor: {horizontal_coor}')
         # print(f'Rows: {num_rows}, Cols: {num_cols}')
 
+        if num_rows > 0 and num_cols > 0 and self._use_table_grid(num_rows * num_cols):
+            grid = TableGrid(self.verticals, self.horizontals, self.texts, self._SEARCH_DISTANCE)
+            return grid.intermediate(vertical_coor, horizontal_coor)
+
+        self._build_table_index()
+
         intermediate = [[] for idx in range(num_rows)]
         for row_idx in range(num_rows):
             for col_idx in range(num_cols):
@@ -491,9 +523,32 @@ class Pile(object):
 
         return intermediate
 
+    def _use_table_grid(self, num_cells):
+        if self.table_engine == 'python':
+            return False
+        elif self.table_engine == 'numpy':
+            if not numpy_available():
+                raise Exception('NumPy is required for the numpy table engine')
+            return True
+        elif self.table_engine == 'auto':
+            return numpy_available() and num_cells >= self._TABLE_GRID_CELLS
+        else:
+            raise Exception('No such table engine')
+
+    def _build_table_index(self):
+        # Built once per table pile, after the rules are final, so that cell
+        # lookups do not rescan every text and every rule of the table.
+        self._rule_indexes = {
+            'vertical': RuleIndex(self.verticals, 'x0'),
+            'horizontal': RuleIndex(self.horizontals, 'y0'),
+        }
+        self._text_index = TextIndex(self.texts)
+
     def _find_cell_texts(self, left, top, right, bottom):
         texts = []
-        for text in self.texts:
+        candidates = self._text_index.in_band(
+            bottom - self._SEARCH_DISTANCE, top + self._SEARCH_DISTANCE)
+        for text in candidates:
             if self._in_range(left, top, right, bottom, text):
                 texts.append(text)
         return texts
@@ -543,19 +598,13 @@ class Pile(object):
 
     def _line_exists(self, target, minimum, maximum, direction):
         if direction == 'vertical':
-            lines = self.verticals
-            attr = 'x0'
             fill_range = self._fill_vertical_range
         elif direction == 'horizontal':
-            lines = self.horizontals
-            attr = 'y0'
             fill_range = self._fill_horizontal_range
         else:
             raise Exception('No such direction')
 
-        for line in lines:
-            if getattr(line, attr) != target:
-                continue
+        for line in self._rule_indexes[direction].lines_at(target):
             if fill_range(minimum, maximum, line):
                 return True
 
@@ -604,10 +653,32 @@ class Pile(object):
         return indent + '<td' + colspan + rowspan + '>' + texts + '</td>\n'
 
     def _calc_coordinates(self, axes, attr, reverse):
-        coor_set = set()
-        for axis in axes:
-            # coor_set.add(getattr(axis, attr))
-            coor_set.add(round(getattr(axis, attr), 3))
+        # Rules share few distinct coordinates, so each is rounded only once
+        values = {getattr(axis, attr) for axis in axes}
+        coor_set = {round(value, 3) for value in values}
         coor_list = list(coor_set)
         coor_list.sort(reverse=reverse)
         return coor_list
+
+
+def _detach_object(obj, memo):
+    obj = resolve1(obj)
+    if id(obj) in memo:
+        return memo[id(obj)]
+
+    if isinstance(obj, PDFStream):
+        memo[id(obj)] = obj
+        obj.get_data()
+        obj.decipher = None
+        obj.attrs = _detach_object(obj.attrs, memo)
+    elif isinstance(obj, dict):
+        detached = memo[id(obj)] = {}
+        for key, value in obj.items():
+            detached[key] = _detach_object(value, memo)
+        obj = detached
+    elif isinstance(obj, list):
+        detached = memo[id(obj)] = []
+        for value in obj:
+            detached.append(_detach_object(value, memo))
+        obj = detached
+    return obj
@@ -0,0 +1,106 @@
+import re
+
+
+class Substitution(object):
+    # A single regex substitution over the whole text.
+    def __init__(self, pattern, repl, name=None):
+        self.name = name
+        self._regex = re.compile(pattern)
+        self._repl = repl
+
+    def apply(self, text):
+        return self._regex.sub(self._repl, text)
+
+
+class Replace(object):
+    # A plain substring replacement; no regex machinery involved.
+    def __init__(self, old, new, name=None):
+        self.name = name
+        self._old = old
+        self._new = new
+
+    def apply(self, text):
+        return text.replace(self._old, self._new)
+
+
+class FusedSubstitution(object):
+    # Several substitutions done in one scan of the text. Only fuse
+    # patterns that can neither create nor destroy each other's matches;
+    # replacements are literal strings (no group references).
+    def __init__(self, substitutions, name=None):
+        self.name = name
+        self._substitutions = []
+        for pattern, repl in substitutions:
+            self._substitutions.append((pattern, repl))
+        self._compile()
+
+    def add(self, pattern, repl):
+        self._substitutions.append((pattern, repl))
+        self._compile()
+
+    def apply(self, text):
+        return self._regex.sub(self._repl, text)
+
+    def _compile(self):
+        repls = {repl for pattern, repl in self._substitutions}
+        if len(repls) == 1:
+            # Same replacement everywhere: a plain alternation is enough.
+            self._regex = re.compile('|'.join(
+                '(?:{})'.format(pattern) for pattern, repl in self._substitutions))
+            self._repl = repls.pop().replace('\\', r'\\')
+        else:
+            self._regex = re.compile('|'.join(
+                '(?P<_{}>{})'.format(idx, pattern)
+                for idx, (pattern, repl) in enumerate(self._substitutions)))
+            by_group = {'_{}'.format(idx): repl
+                        for idx, (pattern, repl) in enumerate(self._substitutions)}
+            self._repl = lambda mo: by_group[mo.lastgroup]
+
+
+class PostProcessor(object):
+    # Ordered pipeline of rules; each rule is one pass over the text.
+    def __init__(self, rules=None):
+        self.rules = list(rules) if rules else []
+
+    def add(self, rule):
+        self.rules.append(rule)
+        return self
+
+    def insert(self, index, rule):
+        self.rules.insert(index, rule)
+        return self
+
+    def find(self, name):
+        for rule in self.rules:
+            if rule.name == name:
+                return rule
+        raise Exception('No such rule: ' + name)
+
+    def apply(self, text):
+        for rule in self.rules:
+            text = rule.apply(text)
+        return text
+
+
+def paragraph_postprocessor():
+    return PostProcessor([
+        # Удаляет цифру в конце строки, если затем идет перенос строки
+        Substitution(r'[^\d+]\d{1,2}\s+\n', '\n', name='page-numbers'),
+        Substitution(r'[^\d+]\d{1,2}\s+\n$', '\n', name='last-page-number'),
+        FusedSubstitution([
+            (r' {2,}', ' '),
+            (r'\n{2,10}', '\n'),
+        ], name='whitespace'),
+        Replace('\uf0b7', '>', name='bullets'),
+        # Удаление случаев, когда есть пробел, перенос строки, и сразу за переносом идет маленькая буква
+        FusedSubstitution([
+            (r' \n(?=[а-я0-9\(\«)])', ' '),
+            (r'(?<=[\–]) \n(?=[А-Я\(\-])', ' '),
+            (r'(?<=[\>\-]) \n', ' '),
+        ], name='line-joins'),
+        # Удаление переноса строки между строками, начинающимися с '# '
+        Substitution(r'\n#(?=\s)', '', name='heading-joins'),
+        # Удаление переноса строки где он идет сразу после установки пунктов (1., 1.2)
+        Substitution(r'(\#{1}\s(\d+\.){0,3}\s)\n', r'\1', name='numbering-joins'),
+        Substitution(r'\sстр. \d+ из', '', name='page-footers'),
+    ])
@@ -0,0 +1,64 @@
+class Box(object):
+    # Bounding box with the same attributes as pdfminer's LTComponent
+    __slots__ = ('x0', 'y0', 'x1', 'y1')
+
+    def __init__(self, bbox):
+        self.set_bbox(bbox)
+
+    def set_bbox(self, bbox):
+        (self.x0, self.y0, self.x1, self.y1) = bbox
+
+    @property
+    def bbox(self):
+        return (self.x0, self.y0, self.x1, self.y1)
+
+    @property
+    def width(self):
+        return self.x1 - self.x0
+
+    @property
+    def height(self):
+        return self.y1 - self.y0
+
+
+class TextLine(Box):
+    # A text line reduced to what piles and syntaxes read: geometry, text,
+    # rounded size and the per-line font facts (fonts.LineFonts).
+    __slots__ = ('text', 'size', 'chars', 'font', 'bold', 'italic', 'fonts')
+
+    def __init__(self, line, fonts):
+        Box.__init__(self, line.bbox)
+        self.text = line.get_text()
+        self.size = round(line.height, 0)
+        self.chars = len(line._objs)
+        self.font = fonts.font
+        self.bold = fonts.bold
+        self.italic = fonts.italic
+        self.fonts = fonts
+
+    def get_text(self):
+        return self.text
+
+
+class Rule(Box):
+    # A thin rect used as a table ruling line. Like pdfminer's LTRect it
+    # keeps its corners ordered, whichever way round they are given.
+    __slots__ = ()
+
+    def set_bbox(self, bbox):
+        (x0, y0, x1, y1) = bbox
+        Box.set_bbox(self, (min(x0, x1), min(y0, y1), max(x0, x1), max(y0, y1)))
+
+
+class Image(Box):
+    # Everything pdfminer's ImageWriter needs to export an LTImage
+    __slots__ = ('name', 'stream', 'srcsize', 'imagemask', 'bits', 'colorspace')
+
+    def __init__(self, image):
+        Box.__init__(self, image.bbox)
+        self.name = image.name
+        self.stream = image.stream
+        self.srcsize = image.srcsize
+        self.imagemask = image.imagemask
+        self.bits = image.bits
+        self.colorspace = image.colorspace
@@ -0,0 +1,383 @@
+import argparse
+import json
+import multiprocessing
+import os
+import queue
+import re
+import shutil
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from parser import Parser
+from writer import Writer
+from syntax import Syntax
+from syntax import UrbanSyntax
+from budget import Budget
+
+
+SYNTAXES = {'plain': Syntax, 'urban': UrbanSyntax}
+LAYOUT_MODES = ('boxes', 'lines')
+_REQUEST_DIR = re.compile(r'[0-9a-f]{32}$')
+
+
+class ConversionServer(object):
+    # Long-running HTTP front end for Parser + Writer. A fixed set of worker
+    # processes is started up front and kept warm (modules imported,
+    # nothing to set up per request); each one converts a single document
+    # at a time. Requests beyond the busy workers wait in a queue of
+    # queue_size; when that is full too the server answers 429 right away
+    # instead of piling up work. Markdown is sent back with chunked
+    # encoding pile by pile as the worker produces it.
+    #
+    #   POST /convert?syntax=urban&layout_mode=boxes&first=1&last=3
+    #       body: the PDF, or empty with path=/file/on/server.pdf
+    #   GET /status
+    #
+    # Every request exports its images to a directory of its own,
+    # <output_dir>/images/<request id>, linked as images/<request id>/...,
+    # so the markdown can be saved into output_dir as is and concurrent
+    # conversions never share names. The id is sent back in X-Request-Id.
+    # Request directories older than image_ttl seconds are removed (None
+    # keeps them). budget (a budget.Budget) applies to every conversion.
+    def __init__(self, host='127.0.0.1', port=8765, workers=None, queue_size=8,
+                 timeout=300, output_dir=None, max_upload=256 * 1024 ** 2,
+                 budget=None, image_ttl=24 * 3600):
+        self._workers = workers or os.cpu_count() or 1
+        self._timeout = timeout
+        self._output_dir = os.path.abspath(output_dir or os.getcwd())
+        self._budget = budget
+        self._image_ttl = image_ttl
+        self._swept = 0
+        self.max_upload = max_upload
+        self._slots = threading.BoundedSemaphore(self._workers + queue_size)
+        self._idle = queue.Queue()
+        self._lock = threading.Lock()
+        self._counts = {'accepted': 0, 'rejected': 0, 'failed': 0}
+        # Replacement workers are started from handler threads, where
+        # forking is unsafe
+        self._context = multiprocessing.get_context('spawn')
+        for idx in range(self._workers):
+            self._idle.put(_Worker(self._context, self._output_dir, self._budget))
+
+        self.httpd = ThreadingHTTPServer((host, port), _Handler)
+        self.httpd.daemon_threads = True
+        self.httpd.conversion_server = self
+
+    def serve_forever(self):
+        try:
+            self.httpd.serve_forever()
+        finally:
+            self.close()
+
+    def close(self):
+        self.httpd.server_close()
+        while True:
+            try:
+                self._idle.get_nowait().stop()
+            except queue.Empty:
+                break
+
+    def get_status(self):
+        with self._lock:
+            status = dict(self._counts)
+        status['workers'] = self._workers
+        status['idle_workers'] = self._idle.qsize()
+        return status
+
+    def admit(self):
+        # False when every worker is busy and the queue is full
+        admitted = self._slots.acquire(blocking=False)
+        self._count('accepted' if admitted else 'rejected')
+        return admitted
+
+    def release(self):
+        self._slots.release()
+
+    def sweep_images(self):
+        # Removes expired request directories, at most once a minute
+        now = time.time()
+        with self._lock:
+            if self._image_ttl is None or now - self._swept < 60:
+                return
+            self._swept = now
+        images = os.path.join(self._output_dir, 'images')
+        try:
+            names = os.listdir(images)
+        except FileNotFoundError:
+            return
+        for name in names:
+            path = os.path.join(images, name)
+            try:
+                expired = now - os.path.getmtime(path) > self._image_ttl
+            except OSError:
+                continue
+            if _REQUEST_DIR.match(name) and os.path.isdir(path) and expired:
+                shutil.rmtree(path, ignore_errors=True)
+
+    def run(self, job):
+        # Yields ('chunk', markdown) messages, then ('done', None) or
+        # ('error', message). The worker goes back to the pool only once
+        # it has finished, so a client that disconnects early must still
+        # let the generator run out (close() takes care of that).
+        worker = self._idle.get()
+        finished = False
+        try:
+            worker.conn.send(job)
+            while True:
+                if not worker.conn.poll(self._timeout):
+                    raise Exception('Conversion timed out')
+                message = worker.conn.recv()
+                if message[0] != 'chunk':
+                    finished = True
+                    if message[0] == 'error':
+                        self._count('failed')
+                    yield message
+                    return
+                yield message
+        except GeneratorExit:
+            # Client went away: drain the rest instead of killing a warm
+            # worker, unless it is stuck
+            try:
+                while not finished and worker.conn.poll(self._timeout):
+                    finished = worker.conn.recv()[0] != 'chunk'
+            except (EOFError, OSError):
+                pass
+        except (EOFError, OSError):
+            self._count('failed')
+            yield ('error', 'Worker process died')
+        except Exception as e:
+            self._count('failed')
+            yield ('error', str(e))
+        finally:
+            if not finished:
+                worker.stop()
+                worker = _Worker(self._context, self._output_dir, self._budget)
+            self._idle.put(worker)
+
+    def _count(self, name):
+        with self._lock:
+            self._counts[name] += 1
+
+
+class _Worker(object):
+    def __init__(self, context, output_dir, budget):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=_serve, args=(child_conn, output_dir, budget),
+                                       daemon=True)
+        self.process.start()
+        child_conn.close()
+
+    def stop(self):
+        self.process.terminate()
+        self.process.join()
+        self.conn.close()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        if urlparse(self.path).path != '/status':
+            self._send_error(404, 'Not found')
+            return
+        self._send_json(200, self.server.conversion_server.get_status())
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path != '/convert':
+            self._send_error(404, 'Not found')
+            return
+        try:
+            job = _parse_options(parse_qs(url.query))
+        except Exception as e:
+            self._send_error(400, str(e))
+            return
+
+        server = self.server.conversion_server
+        if not server.admit():
+            self.send_response(429)
+            self.send_header('Retry-After', '1')
+            self._send_body('application/json', json.dumps({'error': 'Server busy'}))
+            self.close_connection = True
+            return
+
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+            if length > server.max_upload:
+                self._send_error(413, 'PDF too large')
+                return
+            if length:
+                # Parsed straight from memory, never written to disk
+                job['pdf'] = _read_body(self.rfile, length)
+            elif job.get('path') is None:
+                self._send_error(400, 'No PDF in the body and no path')
+                return
+            job['request_id'] = uuid.uuid4().hex
+            server.sweep_images()
+            self._stream(server.run(job), job['request_id'])
+        finally:
+            server.release()
+
+    def _stream(self, messages, request_id):
+        try:
+            kind, data = next(messages)
+            if kind == 'error':
+                self._send_error(422, data)
+                return
+
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/markdown; charset=utf-8')
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.send_header('X-Request-Id', request_id)
+            self.end_headers()
+            while kind == 'chunk':
+                self._write_chunk(data.encode('utf-8'))
+                kind, data = next(messages)
+            if kind == 'error':
+                # Too late for a status code; an unterminated body tells the
+                # client the conversion failed
+                self.close_connection = True
+                return
+            self._write_chunk(b'')
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+        finally:
+            messages.close()
+
+    def _write_chunk(self, data):
+        self.wfile.write(b'%x\r\n%s\r\n' % (len(data), data))
+        self.wfile.flush()
+
+    def _send_error(self, code, message):
+        # The request body may not have been read, so the connection
+        # cannot be reused
+        self.send_response(code)
+        self._send_body('application/json', json.dumps({'error': message}))
+        self.close_connection = True
+
+    def _send_json(self, code, data):
+        self.send_response(code)
+        self._send_body('application/json', json.dumps(data))
+
+    def _send_body(self, content_type, text):
+        body = text.encode('utf-8')
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def _parse_options(query):
+    def option(name, default=None):
+        values = query.get(name)
+        return values[-1] if values else default
+
+    job = {
+        'path': option('path'),
+        'syntax': option('syntax', 'urban'),
+        'layout_mode': option('layout_mode', 'boxes'),
+        'first': None,
+        'last': None,
+    }
+    if job['syntax'] not in SYNTAXES:
+        raise Exception('Unsupported syntax: ' + job['syntax'])
+    if job['layout_mode'] not in LAYOUT_MODES:
+        raise Exception('No such layout mode')
+    for name in ('first', 'last'):
+        value = option(name)
+        if value is not None:
+            if not value.isdigit() or int(value) < 1:
+                raise Exception('Page numbers start at 1: ' + name)
+            job[name] = int(value)
+    if job['first'] is not None and job['last'] is not None and job['last'] < job['first']:
+        raise Exception('Empty page range')
+    return job
+
+
+def _read_body(rfile, length):
+    body = bytearray()
+    while len(body) < length:
+        chunk = rfile.read(min(length - len(body), 1 << 20))
+        if not chunk:
+            raise Exception('Truncated upload')
+        body += chunk
+    return bytes(body)
+
+
+def _serve(conn, output_dir, budget):
+    # Worker process main loop: one job at a time until the pipe closes
+    while True:
+        try:
+            job = conn.recv()
+        except EOFError:
+            return
+        try:
+            for markdown in _convert(job, output_dir, budget):
+                conn.send(('chunk', markdown))
+        except Exception as e:
+            conn.send(('error', '{}: {}'.format(type(e).__name__, e)))
+        else:
+            conn.send(('done', None))
+
+
+def _convert(job, output_dir, budget):
+    source = job['pdf'] if job.get('pdf') is not None else job['path']
+    with Parser(source, layout_mode=job['layout_mode'], budget=budget) as parser:
+        writer = Writer()
+        writer.set_syntax(SYNTAXES[job['syntax']]())
+        writer.set_title(os.path.join(output_dir, 'document'))
+        writer.set_image_dir(os.path.join(output_dir, 'images', job['request_id']))
+
+        if job['first'] is None and job['last'] is None:
+            piles = parser.iter_piles()
+        else:
+            first = job['first'] or 1
+            last = job['last'] or parser.get_page_count()
+            if last > parser.get_page_count():
+                raise Exception('The document has {} pages'.format(parser.get_page_count()))
+            piles = (pile for page_num in range(first, last + 1)
+                     for pile in parser.parse(page_num))
+        for markdown in writer.iter_markdown(piles):
+            yield markdown
+
+
+def main():
+    argparser = argparse.ArgumentParser(description='Serve PDF to markdown conversions over HTTP.')
+    argparser.add_argument('--host', default='127.0.0.1')
+    argparser.add_argument('--port', type=int, default=8765)
+    argparser.add_argument('--workers', type=int, help='worker processes (default: one per CPU)')
+    argparser.add_argument('--queue-size', type=int, default=8,
+                           help='requests allowed to wait for a worker before 429')
+    argparser.add_argument('--timeout', type=float, default=300,
+                           help='seconds a worker may go without output')
+    argparser.add_argument('--output-dir', help='where images are exported (default: cwd)')
+    argparser.add_argument('--image-ttl', type=float, default=24 * 3600,
+                           help='seconds the images of a request are kept')
+    argparser.add_argument('--page-seconds', type=float,
+                           help='convert a page as text only, or skip it, after this long')
+    argparser.add_argument('--document-seconds', type=float,
+                           help='skip the pages left after this long')
+    args = argparser.parse_args()
+
+    budget = None
+    if args.page_seconds is not None or args.document_seconds is not None:
+        budget = Budget(page_seconds=args.page_seconds, document_seconds=args.document_seconds)
+    server = ConversionServer(args.host, args.port, args.workers, args.queue_size,
+                              args.timeout, args.output_dir, budget=budget,
+                              image_ttl=args.image_ttl)
+    print('Serving on http://{}:{}'.format(args.host, args.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+from bisect import bisect_left, bisect_right
+from math import floor
+
+
+class RuleIndex(object):
+    # Groups rules by the exact value of one coordinate ('x0' for verticals,
+    # 'y0' for horizontals), keeping the original list order in each group.
+    def __init__(self, lines, attr):
+        self._groups = {}
+        for line in lines:
+            self._groups.setdefault(getattr(line, attr), []).append(line)
+
+    def lines_at(self, coor):
+        return self._groups.get(coor, ())
+
+
+class TextIndex(object):
+    # Texts sorted by y0, so a horizontal band can be cut out with bisect
+    # instead of scanning every text of the pile.
+    def __init__(self, texts):
+        order = sorted(range(len(texts)), key=lambda idx: texts[idx].y0)
+        self._texts = texts
+        self._order = order
+        self._keys = [texts[idx].y0 for idx in order]
+
+    def in_band(self, bottom, top):
+        # Texts with bottom <= y0 <= top, in their original order.
+        start = bisect_left(self._keys, bottom)
+        stop = bisect_right(self._keys, top)
+        return [self._texts[idx] for idx in sorted(self._order[start:stop])]
+
+
+def cluster_by_y(objects, distance):
+    # Groups objects whose vertical extents overlap (within distance),
+    # directly or through other members. One sort by y0 is enough: a new
+    # object either reaches into the cluster being swept or starts the next
+    # one. Clusters come back ordered by their first member in the original
+    # list, and members keep their original order.
+    order = sorted(range(len(objects)), key=lambda idx: objects[idx].y0)
+    clusters = []
+    top = None
+    for idx in order:
+        obj = objects[idx]
+        if clusters and obj.y0 <= top + distance:
+            clusters[-1].append(idx)
+            top = max(top, obj.y1)
+        else:
+            clusters.append([idx])
+            top = obj.y1
+
+    clusters.sort(key=min)
+    return [[objects[idx] for idx in sorted(cluster)] for cluster in clusters]
+
+
+class BandIndex(object):
+    # Disjoint (top, bottom) bands, widened by distance, that can be asked
+    # which of them contain a given y coordinate.
+    def __init__(self, bands, distance):
+        order = sorted(range(len(bands)), key=lambda idx: bands[idx][1])
+        self._order = order
+        self._lows = [bands[idx][1] - distance for idx in order]
+        self._highs = [bands[idx][0] + distance for idx in order]
+
+    def containing(self, *coors):
+        found = set()
+        for coor in coors:
+            pos = bisect_right(self._lows, coor) - 1
+            while pos >= 0 and self._highs[pos] >= coor:
+                found.add(self._order[pos])
+                pos -= 1
+        return sorted(found)
+
+
+class SnapIndex(object):
+    # Coordinate buckets as wide as the snapping distance, so any value
+    # closer than the distance lives in the same or a neighbouring bucket.
+    # find() returns the earliest added item, like a scan of the list would.
+    def __init__(self, distance):
+        self._distance = distance
+        self._buckets = {}
+        self._count = 0
+
+    def add(self, coor, item):
+        key = floor(coor / self._distance)
+        self._buckets.setdefault(key, []).append((self._count, coor, item))
+        self._count += 1
+
+    def find(self, coor):
+        key = floor(coor / self._distance)
+        found = None
+        for bucket in (key - 1, key, key + 1):
+            for order, item_coor, item in self._buckets.get(bucket, ()):
+                if abs(coor - item_coor) < self._distance:
+                    if found is None or order < found[0]:
+                        found = (order, item)
+                    break
+        return found[1] if found is not None else None
@@ -1,104 +1,130 @@
 import re
+from postprocess import paragraph_postprocessor
+
+
+_ROMAN = r'(I|II|III|IV|V|VI|VII|VIII|IX|X)'
+
+_ROMAN_HEADING_RE = re.compile(r'^' + _ROMAN + r'.')
+_PAREN_ROMAN_HEADING_RE = re.compile(r'^(（|\()' + _ROMAN + r'(）|\))')
+_ORDERED_ITEM_RE = re.compile(r'^(\d+\.)+')
+_PARAGRAPH_END_RE = re.compile('\n\n$')
+_SENTENCE_END_RE = re.compile(r'\.$')
+_ROMAN_ITEM_RE = re.compile(_ROMAN + r'. (.*)')
+_PAREN_ROMAN_ITEM_RE = re.compile(r'(（|\()' + _ROMAN + r'(）|\))(.*)')
+_NUMBERED_ITEM_RE = re.compile(r'^\d+、(.*)')
+
+_SIZE_HEADINGS = {18: 'heading-4', 16: 'heading-3', 20: 'heading-2'}
 
 
 class Syntax(object):
     def __init__(self):
-        pass
+        # Cleanup rules applied to every generated paragraph pile
+        self.postprocessor = paragraph_postprocessor()
 
-    def pattern(self):
+    def pattern(self, text):
         return 'plain-text'
 
-    def newline(self):
+    def newline(self, text):
         return True
 
+    def purify(self, text):
+        return text.get_text().strip()
+
+    def classify(self, text):
+        # Returns (pattern, newline, content) for one text line. Subclasses
+        # that only implement the three methods above keep working through
+        # this default; faster syntaxes override it with a single pass.
+        return self.pattern(text), self.newline(text), self.purify(text)
+
 
 class UrbanSyntax(Syntax):
     def __init__(self):
-        pass
+        super().__init__()
+
+    def classify(self, text):
+        raw = text.get_text()
+        content = raw.strip()
+        x0 = text.x0
+        x1 = text.x1
+        return (self._pattern(content, text.size, x0, x1, getattr(text, 'bold', None)),
+                self._newline(raw, x0, x1),
+                self._purify(content))
 
     def pattern(self, text):
-        content = text.get_text().strip()
-        # content = text.get_text().encode('utf8').strip()
+        return self._pattern(text.get_text().strip(), text.size, text.x0, text.x1,
+                             getattr(text, 'bold', None))
+
+    def newline(self, text):
+        return self._newline(text.get_text(), text.x0, text.x1)
+
+    def purify(self, text):
+        return self._purify(text.get_text().strip())
 
+    def _pattern(self, content, size, x0, x1, bold):
         if not content:
             return 'none'
 
         if content.isdigit():  # page number
             return 'none'
 
-        if 130 < text.x0 and text.x1 < 480:
-            if text.size == 12:
+        if 130 < x0 and x1 < 480:
+            if size == 12:
                 return 'heading-2'
-            if text.size < 12:
+            if size < 12:
                 return 'heading-3'
-            if text.size > 12:
+            if size > 12:
                 return 'heading-1'
 
-        if text.size == 18:
-            return 'heading-4'
-
-        if text.size == 16:
-            return 'heading-3'
-
-        if text.size == 20:
-            return 'heading-2'
+        heading = _SIZE_HEADINGS.get(size)
+        if heading:
+            return heading
 
         if content == content.upper():
-            if text.bold:  # special case for neihu page 2
+            if bold:  # special case for neihu page 2
                 return 'heading-2'
             else:
                 return 'heading-3'
 
-        mo = re.search(r'^(I|II|III|IV|V|VI|VII|VIII|IX|X).', content)
-        if mo:
+        if _ROMAN_HEADING_RE.search(content):
             return 'heading-4'
 
-        mo = re.search(r'^(（|\()(I|II|III|IV|V|VI|VII|VIII|IX|X)(）|\))', content)
-        if mo:
+        if _PAREN_ROMAN_HEADING_RE.search(content):
             return 'heading-5'
 
-        mo = re.search(r'^(\d+\.)+', content)
-        if mo:
+        if _ORDERED_ITEM_RE.search(content):
             return 'ordered-list-item'
 
-        if text.x0 < 90.1:  # special case for neihu page 2
+        if x0 < 90.1:  # special case for neihu page 2
             return 'unordered-list-item'
 
         return 'plain-text'
 
-    def newline(self, text):
-        # content = text.get_text().encode('utf8').strip()
-        content = text.get_text() #.strip()
-
-        if text.x0 < 90.1:  # special case for neihu page 2
+    def _newline(self, content, x0, x1):
+        # content is not stripped here
+        if x0 < 90.1:  # special case for neihu page 2
             return True
 
-        mo = re.search('\n\n$', content)
-        if mo:
+        if _PARAGRAPH_END_RE.search(content):
             return True
 
-        mo = re.search('\.$', content)
-        if mo:
+        if _SENTENCE_END_RE.search(content):
             return True
 
-        if text.x1 > 505.0:  # reach the right margin
+        if x1 > 505.0:  # reach the right margin
             return False
 
         return False
 
-    def purify(self, text):
-        # content = text.get_text().encode('utf8').strip()
-        content = text.get_text().strip()
-
-        mo = re.match(r'(I|II|III|IV|V|VI|VII|VIII|IX|X). (.*)', content)
+    def _purify(self, content):
+        mo = _ROMAN_ITEM_RE.match(content)
         if mo:
             return mo.group(2)
 
-        mo = re.match(r'(（|\()(I|II|III|IV|V|VI|VII|VIII|IX|X)(）|\))(.*)', content)
+        mo = _PAREN_ROMAN_ITEM_RE.match(content)
         if mo:
             return mo.group(4)
 
-        mo = re.match(r'^\d+、(.*)', content)
+        mo = _NUMBERED_ITEM_RE.match(content)
         if mo:
             return mo.group(1)
 
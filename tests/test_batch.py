@@ -0,0 +1,124 @@
+import os
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from http.server import SimpleHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+import batch
+import corpus
+from batch import BatchConverter
+from batch import convert_pdf
+from cache import ConversionCache
+
+
+class _Handler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+class _SlowConverter(ThreadPoolExecutor):
+    # Stands in for the process pool: conversions take a while, and the
+    # most ever submitted but not finished is recorded
+    peak = 0
+
+    def __init__(self, max_workers=None):
+        ThreadPoolExecutor.__init__(self, max_workers=max_workers)
+        self._lock = threading.Lock()
+        self._in_flight = 0
+
+    def submit(self, fn, *args):
+        with self._lock:
+            self._in_flight += 1
+            _SlowConverter.peak = max(_SlowConverter.peak, self._in_flight)
+        future = ThreadPoolExecutor.submit(self, self._slowly, fn, *args)
+        future.add_done_callback(self._finished)
+        return future
+
+    def _slowly(self, fn, *args):
+        time.sleep(0.05)
+        return fn(*args)
+
+    def _finished(self, future):
+        with self._lock:
+            self._in_flight -= 1
+
+
+class BatchConverterTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.served = tempfile.mkdtemp()
+        for idx in range(8):
+            corpus.build_prose(os.path.join(cls.served, 'doc{}.pdf'.format(idx)), pages=1)
+        cls.httpd = ThreadingHTTPServer(('127.0.0.1', 0),
+                                        partial(_Handler, directory=cls.served))
+        threading.Thread(target=cls.httpd.serve_forever, daemon=True).start()
+        cls.base = 'http://127.0.0.1:{}/'.format(cls.httpd.server_port)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.httpd.shutdown()
+        cls.httpd.server_close()
+        shutil.rmtree(cls.served)
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+
+    def test_converts_every_link(self):
+        links = [self.base + 'doc{}.pdf'.format(idx) for idx in range(3)]
+        links.append(self.base + 'missing.pdf')
+        results = BatchConverter(self.folder, convert_workers=2).run(links)
+
+        for result in results[:3]:
+            self.assertIsNone(result['error'])
+            with open(result['location'], encoding='utf-8') as fread:
+                self.assertTrue(fread.read().strip())
+        self.assertIsNotNone(results[3]['error'])
+        self.assertIsNone(results[3]['location'])
+
+    def test_conversions_in_flight_are_bounded(self):
+        links = [self.base + 'doc{}.pdf'.format(idx) for idx in range(8)]
+        original = batch.ProcessPoolExecutor
+        batch.ProcessPoolExecutor = _SlowConverter
+        _SlowConverter.peak = 0
+        try:
+            results = BatchConverter(self.folder, convert_workers=1, queue_size=1).run(links)
+        finally:
+            batch.ProcessPoolExecutor = original
+
+        self.assertEqual([result['error'] for result in results], [None] * 8)
+        self.assertLessEqual(_SlowConverter.peak, 2)
+
+
+class ConvertPdfTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+
+    def test_reconversion_leaves_no_stale_images(self):
+        cache = ConversionCache(os.path.join(self.folder, 'cache'))
+        pdf = os.path.join(self.folder, 'docs', 'doc.pdf')
+        os.makedirs(os.path.dirname(pdf))
+        image_dir = os.path.join(self.folder, 'docs', 'images', 'doc')
+
+        # Changed, changed again, then back to the first version (a cache hit)
+        for pages in (2, 3, 2):
+            corpus.build_images(pdf, pages=pages)
+            with open(convert_pdf(pdf, cache), encoding='utf-8') as fread:
+                links = re.findall(r'\]\(images/doc/([^)]+)\)', fread.read())
+            self.assertTrue(links)
+            self.assertEqual(sorted(os.listdir(image_dir)), sorted(set(links)))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+import corpus
+from budget import Budget
+from instrument import Instrumentation
+from parser import Parser
+from syntax import UrbanSyntax
+from writer import Writer
+
+
+class DegradedTimingTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+        self.pdf = os.path.join(self.folder, 'ruled_tables.pdf')
+        corpus.build_ruled_tables(self.pdf)
+
+    def test_stages_add_up_to_wall_time(self):
+        # Every page is over the object budget with its rules and within
+        # it as text only
+        instrumentation = Instrumentation(self.pdf)
+        writer = Writer()
+        writer.set_syntax(UrbanSyntax())
+        writer.set_mode('simple')
+        writer.set_title(os.path.join(self.folder, 'ruled_tables'))
+        writer.set_instrumentation(instrumentation)
+
+        started = time.perf_counter()
+        with Parser(self.pdf, instrumentation=instrumentation,
+                    budget=Budget(page_objects=4500)) as parser:
+            writer.write_stream(parser.iter_piles())
+        wall = time.perf_counter() - started
+
+        self.assertEqual([action for _, _, action in parser.degraded], ['text_only'] * 4)
+        stages = instrumentation.report()['stages']
+        self.assertGreaterEqual(stages['write']['seconds'], 0.0)
+        self.assertLessEqual(sum(stage['seconds'] for stage in stages.values()), wall)
+
+
+if __name__ == '__main__':
+    unittest.main()
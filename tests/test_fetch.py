@@ -0,0 +1,76 @@
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fetch import Fetcher
+
+
+BODY = b'%PDF-1.4 ' + b'x' * 100000
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # /broken/<n> cuts the body short on the first n requests
+    protocol_version = 'HTTP/1.1'
+    requests = {}
+
+    def do_GET(self):
+        count = _Handler.requests[self.path] = _Handler.requests.get(self.path, 0) + 1
+        broken = int(self.path.rsplit('/', 1)[-1])
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(BODY)))
+        self.end_headers()
+        if count <= broken:
+            self.wfile.write(BODY[:len(BODY) // 2])
+            self.wfile.flush()
+            self.close_connection = True
+        else:
+            self.wfile.write(BODY)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FetcherTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.httpd = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+        threading.Thread(target=cls.httpd.serve_forever, daemon=True).start()
+        cls.base = 'http://127.0.0.1:{}/broken/'.format(cls.httpd.server_port)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.httpd.shutdown()
+        cls.httpd.server_close()
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+        self.fetcher = Fetcher(os.path.join(self.folder, 'fetch.json'), backoff=0.01)
+        self.addCleanup(self.fetcher.close)
+
+    def test_truncated_body_is_retried(self):
+        path = os.path.join(self.folder, 'a.pdf')
+        self.assertTrue(self.fetcher.fetch(self.base + '2', path))
+        self.assertEqual(_Handler.requests['/broken/2'], 3)
+        with open(path, 'rb') as fread:
+            self.assertEqual(fread.read(), BODY)
+
+    def test_gives_up_after_retries(self):
+        path = os.path.join(self.folder, 'b.pdf')
+        with self.assertRaises(requests.RequestException):
+            self.fetcher.fetch(self.base + '9', path)
+        self.assertEqual(_Handler.requests['/broken/9'], 4)
+        self.assertEqual(os.listdir(self.folder), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
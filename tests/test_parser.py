@@ -0,0 +1,80 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pdfminer.pdfpage import PDFPage
+
+from parser import Parser
+from parser import _resolve_page
+
+
+def _nested_tree_pdf(pages=6):
+    # Two levels of /Pages nodes; MediaBox and Resources are only set on
+    # the nodes, Rotate on one of the inner nodes
+    objects = {
+        1: b'<< /Type /Catalog /Pages 2 0 R >>',
+        3: b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>',
+    }
+    kids = []
+    half = pages // 2
+    for node, (first, rotate) in enumerate([(0, b''), (half, b'/Rotate 90 ')]):
+        node_id = 4 + node
+        kids.append(node_id)
+        leaves = []
+        for num in range(first, first + half):
+            page_id, content_id = 10 + 2 * num, 11 + 2 * num
+            leaves.append(page_id)
+            stream = 'BT /F1 12 Tf 72 720 Td (Page {}) Tj ET'.format(num + 1).encode('ascii')
+            objects[page_id] = b'<< /Type /Page /Parent %d 0 R /Contents %d 0 R >>' % (
+                node_id, content_id)
+            objects[content_id] = b'<< /Length %d >>\nstream\n%s\nendstream' % (
+                len(stream), stream)
+        objects[node_id] = b'<< /Type /Pages /Parent 2 0 R %s/Kids [%s] /Count %d >>' % (
+            rotate, b' '.join(b'%d 0 R' % leaf for leaf in leaves), len(leaves))
+    objects[2] = (b'<< /Type /Pages /MediaBox [0 0 612 792] '
+                  b'/Resources << /Font << /F1 3 0 R >> >> /Kids [%s] /Count %d >>' % (
+                      b' '.join(b'%d 0 R' % kid for kid in kids), pages))
+
+    data = bytearray(b'%PDF-1.4\n')
+    offsets = {}
+    for objid in sorted(objects):
+        offsets[objid] = len(data)
+        data += b'%d 0 obj\n%s\nendobj\n' % (objid, objects[objid])
+    size = max(objects) + 1
+    xref = len(data)
+    data += b'xref\n0 %d\n0000000000 65535 f \n' % size
+    for objid in range(1, size):
+        if objid in offsets:
+            data += b'%010d 00000 n \n' % offsets[objid]
+        else:
+            data += b'0000000000 65535 f \n'
+    data += b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (size, xref)
+    return bytes(data)
+
+
+class ResolvePageTest(unittest.TestCase):
+    def test_inherited_attributes_match_page_tree(self):
+        with Parser(_nested_tree_pdf()) as parser:
+            document = parser._document
+            pages = list(PDFPage.create_pages(document))
+            self.assertEqual(len(pages), 6)
+            for page in pages:
+                resolved = _resolve_page(document, page.pageid)
+                self.assertEqual(resolved.attrs, page.attrs)
+                self.assertEqual(resolved.mediabox, page.mediabox)
+                self.assertEqual(resolved.rotate, page.rotate)
+            self.assertEqual([page.rotate for page in pages], [0, 0, 0, 90, 90, 90])
+
+    def test_workers_convert_like_serial(self):
+        pdf = _nested_tree_pdf()
+        with Parser(pdf) as serial, Parser(pdf, workers=2) as parallel:
+            expected = [[text.text for text in pile.texts] for pile in serial.iter_piles()]
+            actual = [[text.text for text in pile.texts] for pile in parallel.iter_piles()]
+        self.assertEqual(actual, expected)
+        self.assertEqual(len(expected), 6)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+import os
+import random
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pdfminer.layout import LTRect
+
+import pile
+from pile import Pile
+from records import Box
+from records import Rule
+
+
+class _Text(Box):
+    __slots__ = ('label',)
+
+    def __init__(self, bbox, label):
+        Box.__init__(self, bbox)
+        self.label = label
+
+    def get_text(self):
+        return self.label
+
+
+def _cells(table, engine):
+    table.table_engine = engine
+    try:
+        intermediate = table._gen_table_intermediate()
+    except AssertionError:
+        return 'thin row'
+    return [[[text.label for text in cell['texts']] for cell in row] for row in intermediate]
+
+
+def _random_table(rnd):
+    # Ruled table whose horizontals come in random order and may stick out
+    # past the outer verticals, so edge verticals get synthesized
+    xs = [72.0]
+    for idx in range(rnd.randint(1, 6)):
+        xs.append(xs[-1] + rnd.choice([20, 40, 80.3]))
+    ys = [780.0]
+    for idx in range(rnd.randint(1, 8)):
+        ys.append(ys[-1] - rnd.choice([12, 18.5]))
+    left = rnd.choice([0, 0, 30])
+    right = rnd.choice([0, 0, 30])
+
+    table = Pile()
+    for x in xs[1:-1] if left or right else xs:
+        table.verticals.append(Rule((x, ys[-1], x + 0.5, ys[0])))
+    for y in ys:
+        table.horizontals.append(Rule((xs[0] - left, y, xs[-1] + right, y + 0.5)))
+    rnd.shuffle(table.horizontals)
+    for idx in range(rnd.randint(0, 30)):
+        x0 = rnd.uniform(xs[0] - left, xs[-1] + right)
+        y0 = rnd.uniform(ys[-1], ys[0])
+        table.texts.append(_Text((x0, y0, x0 + rnd.uniform(1, 30), y0 + 6), 't%d' % idx))
+    return table
+
+
+class SyntheticEdgeRulesTest(unittest.TestCase):
+    # Edge verticals that _gen_table_intermediate adds itself are built
+    # from two horizontals in drawing order; they must come out with
+    # ordered corners, like the LTRects they replaced.
+
+    def test_horizontals_drawn_top_to_bottom(self):
+        for engine in ('python', 'numpy'):
+            table = Pile()
+            table.verticals = [Rule((100, 10, 100.5, 100)), Rule((200, 10, 200.5, 100))]
+            table.horizontals = [Rule((50, y, 200.5, y + 0.5)) for y in (100, 50, 10)]
+            table.texts = [_Text((60, 70, 90, 76), 't0'), _Text((120, 70, 150, 76), 't1'),
+                           _Text((60, 20, 90, 26), 't2'), _Text((120, 20, 150, 26), 't3')]
+            self.assertEqual(_cells(table, engine), [[['t0'], ['t1']], [['t2'], ['t3']]])
+
+    def test_random_tables_match_ltrect(self):
+        rnd = random.Random(13)
+        for idx in range(2000):
+            seed = rnd.random()
+            for engine in ('python', 'numpy'):
+                expected = _cells(_random_table(random.Random(seed)), engine)
+                pile.Rule = lambda bbox: LTRect(0, bbox)
+                try:
+                    reference = _cells(_random_table(random.Random(seed)), engine)
+                finally:
+                    pile.Rule = Rule
+                self.assertEqual(expected, reference, (idx, engine))
+
+
+if __name__ == '__main__':
+    unittest.main()
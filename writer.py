@@ -1,11 +1,16 @@
 import os
-import re
-from pdfminer.image import ImageWriter
+from collections import Counter
+from images import ImageExporter
 
 class Writer(object):
     def __init__(self):
         self._mode = 'simple'
         self._title = 'markdown'
+        self._images = []
+        self._image_dir = None
+        self._image_workers = 4
+        self._instrumentation = None
+        self._stats = Counter()
 
     def set_syntax(self, syntax):
         self._syntax = syntax
@@ -16,7 +21,29 @@ class Writer(object):
     def set_title(self, title):
         self._title = title
 
+    def set_image_dir(self, image_dir):
+        # Defaults to 'images' next to the markdown file
+        self._image_dir = image_dir
+
+    def set_image_workers(self, workers):
+        self._image_workers = workers
+
+    def set_instrumentation(self, instrumentation):
+        # Every write() then records 'gen_markdown', 'export_image' and
+        # 'write' (the rest of write(): files, gitbook assembly) with pile
+        # counts and the number of bytes written. Time spent in stages
+        # recorded meanwhile, e.g. by a Parser streaming the piles in, is
+        # not counted as 'write'.
+        self._instrumentation = instrumentation
+
     def write(self, piles):
+        self._images = []
+        instrumentation = self._instrumentation
+        if instrumentation is not None:
+            self._stats = Counter()
+            first_event = len(instrumentation.events)
+            started = instrumentation.clock()
+
         if self._mode == 'simple':
             self._write_simple(piles)
         elif self._mode == 'gitbook':
@@ -24,6 +51,22 @@ class Writer(object):
         else:
             raise Exception('Unsupported mode: ' + self._mode)
 
+        if instrumentation is not None:
+            stats = self._stats
+            seconds = instrumentation.clock() - started
+            seconds -= sum(event['seconds'] for event in instrumentation.events[first_event:])
+            instrumentation.record('gen_markdown', stats['gen_markdown'], piles=stats['piles'])
+            instrumentation.record('export_image', stats['export_image'],
+                                   exported_images=stats['exported_images'],
+                                   deduplicated_images=stats['deduplicated_images'])
+            instrumentation.record('write', seconds - stats['gen_markdown'] - stats['export_image'],
+                                   bytes_written=stats['bytes'])
+
+    def write_stream(self, piles):
+        # Like write(), but accepts any iterable of piles (for example
+        # Parser.iter_piles()) and consumes it exactly once.
+        self.write(iter(piles))
+
     def get_location(self):
         if self._mode == 'simple':
             return self._title + '.md'
@@ -32,113 +75,158 @@ class Writer(object):
         else:
             raise Exception('Unsupported mode: ' + self._mode)
 
-    def _write_simple(self, piles):
-        filename = self._title + '.md'
-        folder = filename.split('\\')[0] if '\\' in filename else ''
-        iw = ImageWriter(f'{folder}\\images')
-        with open(filename, 'w', encoding='utf-8') as fwrite:
+    def get_image_dir(self):
+        if self._image_dir is not None:
+            return self._image_dir
+        return os.path.join(os.path.dirname(self._title), 'images')
+
+    def get_images(self):
+        # Names of the images exported by the last write(), in order
+        return list(self._images)
+
+    def iter_markdown(self, piles):
+        # The markdown of a simple-mode write(), pile by pile, without the
+        # .md file; images are still exported to get_image_dir() and
+        # linked relative to the title's directory. They are encoded and
+        # saved by the exporter's threads meanwhile; the links only need
+        # their names. All images are on disk once the generator is done.
+        image_dir = self.get_image_dir()
+        link_dir = os.path.relpath(image_dir, os.path.dirname(self._title) or os.curdir)
+        link_dir = link_dir.replace(os.sep, '/')
+        exporter = ImageExporter(image_dir, self._image_workers)
+        try:
             for pile in piles:
                 if pile.get_type() == 'image':
-                    image = pile.get_image()
-                    name = iw.export_image(image)
+                    name = self._export_image(exporter, pile)
                     # self._save_image(image, 'images')
-                    markdown = '![{0}](images\{0})\n\n'.format(name)
-                    fwrite.write(markdown)
+                    yield '![{0}]({1}/{0})\n\n'.format(name, link_dir)
                 else:
-                    markdown = pile.gen_markdown(self._syntax)
-                    fwrite.write(markdown)
+                    yield self._gen_markdown(pile)
+        finally:
+            self._close_exporter(exporter)
+
+    def _write_simple(self, piles):
+        filename = self._title + '.md'
+        markdown = self.iter_markdown(piles)
+        try:
+            with open(filename, 'w', encoding='utf-8') as fwrite:
+                for chunk in markdown:
+                    fwrite.write(chunk)
+        finally:
+            markdown.close()
+        if self._instrumentation is not None:
+            self._stats['bytes'] += os.path.getsize(filename)
+
+    def _gen_markdown(self, pile):
+        if self._instrumentation is None:
+            return pile.gen_markdown(self._syntax)
+
+        started = self._instrumentation.clock()
+        markdown = pile.gen_markdown(self._syntax)
+        self._stats['gen_markdown'] += self._instrumentation.clock() - started
+        self._stats['piles'] += 1
+        return markdown
+
+    def _export_image(self, exporter, pile):
+        # The exporter's threads must not read from the PDFDocument
+        if self._instrumentation is None:
+            return exporter.export(pile.detach().get_image())
+
+        started = self._instrumentation.clock()
+        name = exporter.export(pile.detach().get_image())
+        self._stats['export_image'] += self._instrumentation.clock() - started
+        return name
+
+    def _close_exporter(self, exporter):
+        # Waits for the images still being written
+        if self._instrumentation is None:
+            exporter.close()
+        else:
+            started = self._instrumentation.clock()
+            exporter.close()
+            self._stats['export_image'] += self._instrumentation.clock() - started
+        self._images = list(exporter.names)
+        self._stats['exported_images'] += len(exporter.names)
+        self._stats['deduplicated_images'] += exporter.duplicates
 
     def _write_gitbook(self, piles):
-        intermediate = self._gen_gitbook_intermediate(piles)
-        self._write_gitbook_from_intermediate(intermediate)
-
-    def _gen_gitbook_intermediate(self, piles):
-        intermediate = {}
-
-        content = None
-        for pile in piles:
-            markdown = pile.gen_markdown(self._syntax)
-            lines = markdown.split('\n')
-            for line in lines:
-                mo = re.search('^# (.*)', line)
-                if mo and 'title' not in intermediate:
-                    intermediate['title'] = mo.group(1)
-                    intermediate['readme'] = []
-                    intermediate['chapters'] = []
-                    content = intermediate['readme']
-
-                mo = re.search('^## (.*)', line)
-                if mo and 'title' in intermediate:
-                    chapter = {}
-                    chapter['title'] = mo.group(1)
-                    chapter['readme'] = []
-                    chapter['sections'] = []
-                    intermediate['chapters'].append(chapter)
-                    content = chapter['readme']
-
-                mo = re.search('^### (.*)', line)
-                if mo and 'title' in intermediate:
-                    section = {}
-                    section['title'] = mo.group(1)
-                    section['content'] = []
-                    intermediate['chapters'][-1]['sections'].append(section)
-                    content = section['content']
-
-                if content == None:
-                    continue
-
-                content.append(line)
-
-        return intermediate
+        # Lines go straight to the file of the part they belong to (the
+        # book README, a chapter README or a section) as the piles come
+        # in; only the titles are kept, for SUMMARY.md at the end.
+        book_dirname = self._title
+        self._mkdir_anyway(book_dirname)
+
+        title = None
+        chapters = []  # (title, section titles)
+        part = None
+        try:
+            for pile in piles:
+                markdown = self._gen_markdown(pile)
+                for line in markdown.split('\n'):
+                    if title is None:
+                        if not line.startswith('# '):
+                            continue
+                        title = line[2:]
+                        part = self._open_gitbook_file(os.path.join(
+                            book_dirname, 'README.md'), part)
+                    elif line.startswith('## '):
+                        chapter_dirname = os.path.join(
+                            book_dirname, 'chapter-{}'.format(len(chapters)))
+                        self._mkdir_anyway(chapter_dirname)
+                        chapters.append((line[3:], []))
+                        part = self._open_gitbook_file(os.path.join(
+                            chapter_dirname, 'README.md'), part)
+                    elif line.startswith('### '):
+                        if not chapters:
+                            raise Exception('Section before the first chapter: ' + line)
+                        sections = chapters[-1][1]
+                        part = self._open_gitbook_file(os.path.join(
+                            book_dirname, 'chapter-{}'.format(len(chapters) - 1),
+                            'section-{}.md'.format(len(sections))), part)
+                        sections.append(line[4:])
+                    part.write_line(line)
+        finally:
+            if part is not None:
+                self._close_gitbook_file(part)
+
+        if title is None:
+            raise Exception('No title heading for the gitbook')
+        self._write_gitbook_summary(book_dirname, title, chapters)
 
     def _mkdir_anyway(self, dirname):
         if not os.path.exists(dirname):
             os.makedirs(dirname)
 
-    def _write_gitbook_from_intermediate(self, intermediate):
-        book_dirname = self._title
-        self._mkdir_anyway(book_dirname)
-        self._write_gitbook_summary(book_dirname, intermediate)
-        self._write_gitbook_content(book_dirname, intermediate)
+    def _open_gitbook_file(self, filename, previous):
+        if previous is not None:
+            self._close_gitbook_file(previous)
+        return _LineFile(filename)
+
+    def _close_gitbook_file(self, part):
+        part.close()
+        if self._instrumentation is not None:
+            self._stats['bytes'] += os.path.getsize(part.filename)
 
-    def _write_gitbook_summary(self, book_dirname, intermediate):
+    def _write_gitbook_summary(self, book_dirname, title, chapters):
         lines = []
-        line = '* [{}](README.md)'.format(intermediate['title'])
+        line = '* [{}](README.md)'.format(title)
         lines.append(line)
-        chapters = intermediate['chapters']
-        for idx, chapter in enumerate(chapters):
-            line = '* [{}](chapter-{}/README.md)'.format(chapter['title'], idx)
+        for idx, (chapter, sections) in enumerate(chapters):
+            line = '* [{}](chapter-{}/README.md)'.format(chapter, idx)
             lines.append(line)
-            sections = chapter['sections']
             for jdx, section in enumerate(sections):
                 line = '\t* [{}](chapter-{}/section-{}.md)'.format(
-                    section['title'], idx, jdx)
+                    section, idx, jdx)
                 lines.append(line)
 
         self._write_gitbook_file(os.path.join(
             book_dirname, 'SUMMARY.md'), lines)
 
-    def _write_gitbook_content(self, book_dirname, intermediate):
-        self._write_gitbook_file(os.path.join(
-            book_dirname, 'README.md'), intermediate['readme'])
-
-        chapters = intermediate['chapters']
-        for idx, chapter in enumerate(chapters):
-            chapter_dirname = os.path.join(
-                book_dirname, 'chapter-{}'.format(idx))
-            self._mkdir_anyway(chapter_dirname)
-            self._write_gitbook_file(os.path.join(
-                chapter_dirname, 'README.md'), chapter['readme'])
-
-            sections = chapter['sections']
-            for jdx, section in enumerate(sections):
-                section_filename = 'section-{}.md'.format(jdx)
-                self._write_gitbook_file(os.path.join(
-                    chapter_dirname, section_filename), section['content'])
-
     def _write_gitbook_file(self, filename, content):
         with open(filename, 'w') as fwrite:
             fwrite.write('\n'.join(content))
+        if self._instrumentation is not None:
+            self._stats['bytes'] += os.path.getsize(filename)
 
     # def _save_image(self, image, dirname):
     #     self._mkdir_anyway(dirname)
@@ -151,3 +239,19 @@ class Writer(object):
     #     with open(filename, 'wb') as fwrite:
     #         fwrite.write(stream)
     #         fwrite.close()
+
+
+class _LineFile(object):
+    # Text file written one line at a time; the result is the same as
+    # writing '\n'.join(lines) in one go.
+    def __init__(self, filename):
+        self.filename = filename
+        self._fwrite = open(filename, 'w')
+        self._separator = ''
+
+    def write_line(self, line):
+        self._fwrite.write(self._separator + line)
+        self._separator = '\n'
+
+    def close(self):
+        self._fwrite.close()